@@ -0,0 +1,42 @@
+# Times parts of generation, to compare changes meant to speed them up.
+# Run as "python Benchmark.py [name ...]", or without names to run all of them.
+
+import random
+import sys
+import time
+
+from Main import resolve_settings, build_world_graphs
+from Messages import read_messages, repack_messages
+from RuleParser import compiled_logic
+import Unittest as Tests
+
+
+def benchmark_world_count():
+    # Builds the world graphs for more and more worlds.
+    for world_count in (1, 8, 32):
+        compiled_logic.clear()
+        settings = Tests.load_settings('multiworld.sav', seed='TESTTESTTEST')
+        settings.world_count = world_count
+        resolve_settings(settings)
+        start = time.process_time()
+        build_world_graphs(settings)
+        elapsed = time.process_time() - start
+        print('%d worlds: %.2fs, %.3fs per world' % (world_count, elapsed, elapsed / world_count))
+
+
+def benchmark_repack_messages():
+    # Repacks as many messages as the game has.
+    rng = random.Random(0)
+    texts = [bytes(rng.choice(b'abcdefgh \x01\x04') for _ in range(rng.randrange(20, 120))) for _ in range(2300)]
+    rom = Tests.TestMessages().make_rom(texts)
+    messages = read_messages(rom)
+    start = time.process_time()
+    repack_messages(rom, messages)
+    print('repack_messages: %.3fs' % (time.process_time() - start))
+
+
+benchmarks = {name[len('benchmark_'):]: function for name, function in list(globals().items()) if name.startswith('benchmark_')}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
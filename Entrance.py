@@ -10,6 +10,10 @@ class Entrance(object):
         self.connected_region = None
         self.access_rule = lambda state, **kwargs: True
         self.access_rules = []
+        # Item names read by the access rule, or None if unknown
+        self.dependencies = frozenset()
+        # Whether the access rule also reads the search, eg. for time of day
+        self.reads_search = False
         self.reverse = None
         self.replaces = None
         self.assumed = None
@@ -27,6 +31,8 @@ class Entrance(object):
         new_entrance.connected_region = self.connected_region.name
         new_entrance.access_rule = self.access_rule
         new_entrance.access_rules = list(self.access_rules)
+        new_entrance.dependencies = self.dependencies
+        new_entrance.reads_search = self.reads_search
         new_entrance.reverse = self.reverse
         new_entrance.replaces = self.replaces
         new_entrance.assumed = self.assumed
@@ -50,20 +56,30 @@ class Entrance(object):
             return
         self.access_rules.append(lambda_rule)
         self.access_rule = lambda state, **kwargs: all(rule(state, **kwargs) for rule in self.access_rules)
+        rule_dependencies = getattr(lambda_rule, 'dependencies', None)
+        if self.dependencies is None or rule_dependencies is None:
+            self.dependencies = None
+        else:
+            self.dependencies = self.dependencies | rule_dependencies
+        self.reads_search = self.reads_search or getattr(lambda_rule, 'reads_search', True)
 
 
     def set_rule(self, lambda_rule):
         self.access_rule = lambda_rule
         self.access_rules = [lambda_rule]
+        self.dependencies = getattr(lambda_rule, 'dependencies', None)
+        self.reads_search = getattr(lambda_rule, 'reads_search', True)
 
 
     def connect(self, region):
         self.connected_region = region
         region.entrances.append(self)
+        region.world.clear_hint_areas(region)
 
 
     def disconnect(self):
         self.connected_region.entrances.remove(self)
+        self.connected_region.world.clear_hint_areas(self.connected_region)
         previously_connected = self.connected_region
         self.connected_region = None
         return previously_connected
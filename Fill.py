@@ -1,3 +1,4 @@
+from collections import defaultdict
 import random
 import logging
 from State import State
@@ -5,7 +6,7 @@ from Rules import set_shop_rules
 from Location import DisableType
 from ItemPool import remove_junk_items
 from Item import ItemFactory, ItemInfo
-from Search import Search
+from Search import Search, DecrementalSearch
 
 logger = logging.getLogger('')
 
@@ -340,6 +341,57 @@ def fill_ownworld_restrictive(window, worlds, search, locations, ownpool, itempo
 
 
 
+# Which of a fill stage's locations each kind of item may be placed at, ignoring reachability.
+# Used by the 'eligibility' fill algorithm: the item and region rules of a location are checked
+# at most once per kind of item instead of for every item placed, and the locations known not to
+# allow an item are masked out of the bitset of locations left before picking among them.
+class FillEligibility(object):
+
+    def __init__(self, locations, check_disabled=True):
+        self.locations = list(locations)
+        self.check_disabled = check_disabled
+        self.bits = {location: 1 << index for index, location in enumerate(self.locations)}
+        self.available = (1 << len(self.locations)) - 1
+        # For each kind of item, the bits of the locations checked, and of those that allow it.
+        # Item and region rules only read these of the item, and the settings of its world.
+        self.checked = defaultdict(int)
+        self.allowed = defaultdict(int)
+
+
+    def can_fill(self, location, item):
+        if self.check_disabled and ((location.minor_only and item.majoritem) or location.is_disabled()):
+            return False
+        return location.can_fill_fast(item)
+
+
+    # Yields the locations left that allow the item, in a random order.
+    # Only the locations looked at are shuffled in and checked.
+    def candidates(self, item):
+        key = (item.name, item.world.id, item.advancement, item.priority)
+        mask = self.available & ~(self.checked[key] & ~self.allowed[key])
+        locations = [self.locations[index] for index, bit in enumerate(reversed(bin(mask)[2:])) if bit == '1']
+        for index in range(len(locations)):
+            swap = random.randrange(index, len(locations))
+            locations[index], locations[swap] = locations[swap], locations[index]
+            location = locations[index]
+            bit = self.bits[location]
+            if not self.checked[key] & bit:
+                self.checked[key] |= bit
+                if self.can_fill(location, item):
+                    self.allowed[key] |= bit
+            if self.allowed[key] & bit:
+                yield location
+
+
+    def count(self, item):
+        key = (item.name, item.world.id, item.advancement, item.priority)
+        return bin(self.available & self.allowed[key]).count('1')
+
+
+    def remove(self, location):
+        self.available &= ~self.bits[location]
+
+
 # Places items in the itempool into locations.
 # worlds is a list of worlds and is redundant of the worlds in the base_state_list
 # base_state_list is a list of world states prior to placing items in the item pool
@@ -358,10 +410,12 @@ def fill_ownworld_restrictive(window, worlds, search, locations, ownpool, itempo
 # those two lists cannot be guaranteed.
 def fill_restrictive(window, worlds, base_search, locations, itempool, count=-1):
     unplaced_items = []
+    eligibility = FillEligibility(locations) if worlds[0].settings.fill_algorithm == 'eligibility' else None
 
-    # don't run over this search, just keep it as an item collection
-    items_search = base_search.copy()
-    items_search.collect_all(itempool)
+    # don't run over the base search. This one holds every item left to place,
+    # and removing an item only re-explores from the first sphere that needed it.
+    max_search = DecrementalSearch.from_search(base_search)
+    max_search.collect_all(itempool)
     logging.getLogger('').debug(f'Placing {len(itempool)} items among {len(locations)} potential locations.')
 
     # loop until there are no items or locations
@@ -372,16 +426,19 @@ def fill_restrictive(window, worlds, base_search, locations, itempool, count=-1)
 
         # get an item and remove it from the itempool
         item_to_place = itempool.pop()
-        if item_to_place.majoritem:
-            l2cations = [l for l in locations if not l.minor_only]
+        if eligibility:
+            # already in a random order
+            l2cations = eligibility.candidates(item_to_place)
         else:
-            l2cations = locations
-        random.shuffle(l2cations)
+            if item_to_place.majoritem:
+                l2cations = [l for l in locations if not l.minor_only]
+            else:
+                l2cations = locations
+            random.shuffle(l2cations)
 
         # generate the max search with every remaining item
         # this will allow us to place this item in a reachable location
-        items_search.uncollect(item_to_place)
-        max_search = items_search.copy()
+        max_search.uncollect(item_to_place)
         max_search.collect_locations()
 
         # perform_access_check checks location reachability
@@ -402,7 +459,12 @@ def fill_restrictive(window, worlds, base_search, locations, itempool, count=-1)
         # in the world we are placing it (possibly checking for reachability)
         spot_to_fill = None
         for location in l2cations:
-            if location.can_fill(max_search.state_list[location.world.id], item_to_place, perform_access_check):
+            if eligibility:
+                # the candidates only need to be checked for reachability
+                can_fill = not perform_access_check or max_search.spot_access(location, 'either')
+            else:
+                can_fill = location.can_fill(max_search.state_list[location.world.id], item_to_place, perform_access_check)
+            if can_fill:
                 # for multiworld, make it so that the location is also reachable
                 # in the world the item is for. This is to prevent early restrictions
                 # in one world being placed late in another world. If this is not
@@ -443,15 +505,17 @@ def fill_restrictive(window, worlds, base_search, locations, itempool, count=-1)
             if count > 0:
                 # don't decrement count, we didn't place anything
                 unplaced_items.append(item_to_place)
-                items_search.collect(item_to_place)
+                max_search.collect(item_to_place)
                 continue
             else:
                 # we expect all items to be placed
-                raise FillError('Game unbeatable: No more spots to place %s [World %d] from %d locations (%d total); %d other items left to place, plus %d skipped' % (item_to_place, item_to_place.world.id + 1, len(l2cations), len(locations), len(itempool), len(unplaced_items)))
+                raise FillError('Game unbeatable: No more spots to place %s [World %d] from %d locations (%d total); %d other items left to place, plus %d skipped' % (item_to_place, item_to_place.world.id + 1, eligibility.count(item_to_place) if eligibility else len(l2cations), len(locations), len(itempool), len(unplaced_items)))
 
         # Place the item in the world and continue
         spot_to_fill.world.push_item(spot_to_fill, item_to_place)
         locations.remove(spot_to_fill)
+        if eligibility:
+            eligibility.remove(spot_to_fill)
         window.fillcount += 1
         window.update_progress(5 + ((window.fillcount / window.locationcount) * 30))
 
@@ -471,16 +535,22 @@ def fill_restrictive(window, worlds, base_search, locations, itempool, count=-1)
 # It does not check for reachability, only that the item is
 # allowed in the location
 def fill_restrictive_fast(window, worlds, locations, itempool):
+    eligibility = FillEligibility(locations, check_disabled=False) if worlds[0].settings.fill_algorithm == 'eligibility' else None
     while itempool and locations:
         item_to_place = itempool.pop()
-        random.shuffle(locations)
 
         # get location that allows this item
         spot_to_fill = None
-        for location in locations:
-            if location.can_fill_fast(item_to_place):
-                spot_to_fill = location
-                break
+        if eligibility:
+            spot_to_fill = next(eligibility.candidates(item_to_place), None)
+            if spot_to_fill is not None:
+                eligibility.remove(spot_to_fill)
+        else:
+            random.shuffle(locations)
+            for location in locations:
+                if location.can_fill_fast(item_to_place):
+                    spot_to_fill = location
+                    break
 
         # if we failed to find a suitable location, then stop placing items
         # we don't need to check beatability since world must be beatable
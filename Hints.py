@@ -1,12 +1,16 @@
+import copy
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import random
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import urllib.request
 from urllib.error import URLError, HTTPError
 import json
 from enum import Enum
 import itertools
+import traceback
 
 from HintList import getHint, getMulti, getHintGroup, getUpgradeHintList, hintExclusions, misc_item_hint_table
 from Item import MakeEventItem
@@ -166,19 +170,7 @@ def add_hint(spoiler, world, groups, gossip_text, count, locations=[], force_rea
 
                 if not first or reachable:
                     if first and locations:
-                        # just name the event item after the gossip stone directly
-                        event_item = None
-                        for i, stone_name in enumerate(stone_names):
-                            # place the same event item in each location in the group
-                            if event_item is None:
-                                event_item = MakeEventItem(stone_name, stone_locations[i], event_item)
-                            else:
-                                MakeEventItem(stone_name, stone_locations[i], event_item)
-
-                        # This mostly guarantees that we don't lock the player out of an item hint
-                        # by establishing a (hint -> item) -> hint -> item -> (first hint) loop
-                        for location in locations:
-                            location.add_rule(world.parser.parse_rule(repr(event_item.name)))
+                        add_hint_events(world, stone_names, locations)
 
                     total -= 1
                     first = False
@@ -228,14 +220,94 @@ def add_hint(spoiler, world, groups, gossip_text, count, locations=[], force_rea
     return success
 
 
+def add_hint_events(world, stone_names, locations):
+    if hint_events is not None:
+        hint_events.append((stone_names, locations, save_hint_events(world, stone_names, locations)))
+    # Before the rules are added, as searches checked afterwards wouldn't reach the locations anymore.
+    clear_hint_searches(locations)
+    # just name the event item after the gossip stone directly
+    event_item = None
+    for stone_name in stone_names:
+        # place the same event item in each location in the group
+        event_item = MakeEventItem(stone_name, world.get_location(stone_name), event_item)
+
+    # This mostly guarantees that we don't lock the player out of an item hint
+    # by establishing a (hint -> item) -> hint -> item -> (first hint) loop
+    for location in locations:
+        location.add_rule(world.parser.parse_rule(repr(event_item.name)))
+
+
+# The stones, hinted locations and what they were before, of each add_hint_events call,
+# while each world's hints are built on their own.
+hint_events = None
+
+
+# Returns what add_hint_events changes, for undo_hint_events.
+def save_hint_events(world, stone_names, locations):
+    locations = {world.get_location(stone_name) for stone_name in stone_names} | set(locations)
+    return ([(location, location.item, location.locked, location.internal, location.price, location.always,
+              location.access_rule, list(location.access_rules), location.dependencies, location.reads_search)
+             for location in locations],
+            world, set(world.event_items))
+
+
+def undo_hint_events(events):
+    # Searches that reach every hinted location with the rules the events added reach the same
+    # without them, but the others may reach more, so they are dropped.
+    if hint_searches is not None:
+        hinted_locations = {location for _, locations, _ in events for location in locations}
+        for key, search in list(hint_searches.items()):
+            if not all(search.spot_access(location) for location in hinted_locations):
+                del hint_searches[key]
+    for _, _, (locations, world, event_items) in reversed(events):
+        for location, item, locked, internal, price, always, access_rule, access_rules, dependencies, reads_search in locations:
+            location.item, location.locked, location.internal, location.price, location.always = item, locked, internal, price, always
+            location.access_rule, location.access_rules = access_rule, access_rules
+            location.dependencies, location.reads_search = dependencies, reads_search
+        world.event_items = event_items
+
+
+# The searches of everything reachable without the item at a hinted location, by location, and
+# of everything reachable by None. They are shared by every stone and world while buildGossipHints
+# runs, until a hint adds rules to locations they reach. Each search holds a copy of every world's
+# state, about 60KB per world, and there is one per hinted location, so for large multiworld seeds
+# only the max_hint_searches used last are kept.
+hint_searches = None
+max_hint_searches = 64
+
+
+def get_hint_search(worlds, location=None):
+    if hint_searches is not None and location in hint_searches:
+        hint_searches.move_to_end(location)
+        return hint_searches[location]
+    if location is None:
+        search = Search.max_explore([world.state for world in worlds])
+    else:
+        old_item = location.item
+        location.item = None
+        search = Search.max_explore([world.state for world in worlds])
+        location.item = old_item
+    if hint_searches is not None:
+        hint_searches[location] = search
+        if len(hint_searches) > max_hint_searches:
+            hint_searches.popitem(last=False)
+    return search
+
+
+# Hints only add rules to the locations they are about, which can't make anything else reachable.
+# Searches that couldn't reach those locations before the rules are added are still the same.
+def clear_hint_searches(locations):
+    if hint_searches is not None:
+        for key, search in list(hint_searches.items()):
+            if any(search.spot_access(location) for location in locations):
+                del hint_searches[key]
+
+
 def can_reach_hint(worlds, hint_location, location):
     if location == None:
         return True
 
-    old_item = location.item
-    location.item = None
-    search = Search.max_explore([world.state for world in worlds])
-    location.item = old_item
+    search = get_hint_search(worlds, location)
 
     return (search.spot_access(hint_location)
             and (hint_location.type != 'HintStone' or search.state_list[location.world.id].guarantee_hint()))
@@ -343,30 +415,41 @@ class HintArea(Enum):
 
     # Peforms a breadth first search to find the closest hint area from a given spot (region, location, or entrance).
     # May fail to find a hint if the given spot is only accessible from the root and not from any other region with a hint area
+    # Every spot in a region has the same hint area, so the world keeps the one found for each region,
+    # until an entrance to one of the regions searched through is connected or disconnected.
     @staticmethod
     def at(spot):
         if isinstance(spot, Region):
             original_parent = spot
         else:
             original_parent = spot.parent_region
-        already_checked = []
-        spot_queue = [spot]
+        world = original_parent.world
 
-        while spot_queue:
-            current_spot = spot_queue.pop(0)
-            already_checked.append(current_spot)
+        if original_parent not in world.hint_areas:
+            hint_area = None
+            already_checked = set()
+            spot_queue = deque([original_parent])
 
-            if isinstance(current_spot, Region):
-                parent_region = current_spot
-            else:
-                parent_region = current_spot.parent_region
+            while spot_queue:
+                current_spot = spot_queue.popleft()
+                already_checked.add(current_spot)
+
+                if isinstance(current_spot, Region):
+                    parent_region = current_spot
+                else:
+                    parent_region = current_spot.parent_region
 
-            if parent_region.hint and (original_parent.name == 'Root' or parent_region.name != 'Root'):
-                return parent_region.hint
+                if parent_region.hint and (original_parent.name == 'Root' or parent_region.name != 'Root'):
+                    hint_area = parent_region.hint
+                    break
 
-            spot_queue.extend(list(filter(lambda ent: ent not in already_checked, parent_region.entrances)))
+                world.hint_area_dependents[parent_region].add(original_parent)
+                spot_queue.extend(list(filter(lambda ent: ent not in already_checked, parent_region.entrances)))
+            world.hint_areas[original_parent] = hint_area
 
-        raise HintAreaNotFound('No hint area could be found for %s [World %d]' % (spot, spot.world.id))
+        if world.hint_areas[original_parent] is None:
+            raise HintAreaNotFound('No hint area could be found for %s [World %d]' % (spot, spot.world.id))
+        return world.hint_areas[original_parent]
 
     def __str__(self):
         return self.value[2]
@@ -1069,6 +1152,15 @@ def alwaysNamedItem(world, locations):
 
 
 def buildGossipHints(spoiler, worlds):
+    global hint_searches
+    hint_searches = OrderedDict()
+    try:
+        buildAllGossipHints(spoiler, worlds)
+    finally:
+        hint_searches = None
+
+
+def buildAllGossipHints(spoiler, worlds):
     checkedLocations = dict()
     # Add misc. item hint locations to "checked" locations if the respective hint is reachable without the hinted item.
     for world in worlds:
@@ -1080,9 +1172,131 @@ def buildGossipHints(spoiler, worlds):
                 checkedLocations[item_world.id].add(location.name)
 
     # Build all the hints.
+    if worlds[0].settings.hint_jobs > 1 and len(worlds) > 1:
+        buildSeparateGossipHints(spoiler, worlds, checkedLocations)
+    else:
+        for world in worlds:
+            world.update_useless_areas(spoiler)
+            buildWorldGossipHints(spoiler, world, checkedLocations.pop(world.id, None))
+
+
+# Builds the hints of each world on their own, from the worlds as they are now, so they don't depend
+# on the hints of the other worlds. Each world's are built in a process forked for it, up to hint_jobs
+# at a time, or where processes can't be forked, here from a copy of the worlds. Each world's hints are
+# seeded from one seed and its id, so they are the same however many processes build them, and later
+# steps continue from the random state as it was.
+# The hints are then added in the order of the worlds, and only if the hinted locations can still be
+# reached from their stones with the rules the hints before them added. Otherwise, that world's
+# hints are built again here, after the ones before it, like serial hints are.
+def buildSeparateGossipHints(spoiler, worlds, checkedLocations):
     for world in worlds:
         world.update_useless_areas(spoiler)
-        buildWorldGossipHints(spoiler, world, checkedLocations.pop(world.id, None))
+    random_state = random.getstate()
+    seed = random.getrandbits(64)
+    # Daemonic processes, like those of a multiprocessing.Pool, can't start processes of their own.
+    if 'fork' in multiprocessing.get_all_start_methods() and not multiprocessing.current_process().daemon:
+        results = buildGossipHintsProcesses(spoiler, worlds, checkedLocations, seed)
+    else:
+        results = [buildWorldGossipHintsCopy(spoiler, worlds, checkedLocations, seed, world.id) for world in worlds]
+
+    global hint_events
+    for world, (hints, events) in zip(worlds, results):
+        hint_events = []
+        try:
+            for stone_names, locations in events:
+                add_hint_events(world, stone_names, [worlds[world_id].get_location(name) for world_id, name in locations])
+            added_events = hint_events
+        finally:
+            hint_events = None
+        # Rules only get stricter, so if the hinted locations can be reached with every event added,
+        # they could be when each one was added, which is what add_hint checks.
+        if all(any(can_reach_hint(worlds, world.get_location(stone_name), location) for stone_name in stone_names)
+               for stone_names, locations, _ in added_events for location in locations):
+            spoiler.hints[world.id] = hints
+        else:
+            logging.getLogger('').info('Building the hints of world %d again, as hints of the worlds before it changed what they can reach.', world.id + 1)
+            undo_hint_events(added_events)
+            random.seed('%d-%d' % (seed, world.id))
+            buildWorldGossipHints(spoiler, world, set(checkedLocations.get(world.id, ())))
+    random.setstate(random_state)
+
+
+# Returns the hints and events of each world, each built in a forked process, up to hint_jobs at a time.
+# Processes are forked rather than sent the worlds, which can't be pickled, so each one starts
+# from the worlds as they are here.
+def buildGossipHintsProcesses(spoiler, worlds, checkedLocations, seed):
+    context = multiprocessing.get_context('fork')
+    jobs = min(worlds[0].settings.hint_jobs, len(worlds))
+    running = {}
+    results = {}
+    try:
+        for world in worlds:
+            while len(running) >= jobs:
+                receive_gossip_hints(running, results)
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=buildWorldGossipHintsProcess,
+                    args=(spoiler, worlds, checkedLocations, seed, world.id, worker_connection))
+            process.start()
+            worker_connection.close()
+            running[connection] = (world.id, process)
+        while running:
+            receive_gossip_hints(running, results)
+    finally:
+        for _, process in running.values():
+            process.terminate()
+        for _, process in running.values():
+            process.join()
+    return [results[world.id] for world in worlds]
+
+
+# Waits for a process of buildGossipHintsProcesses to send its world's hints and events.
+def receive_gossip_hints(running, results):
+    connection = multiprocessing.connection.wait(list(running))[0]
+    world_id, process = running.pop(connection)
+    try:
+        try:
+            result, message = connection.recv()
+        except EOFError:
+            raise RuntimeError('Building the hints of world %d exited unexpectedly.' % (world_id + 1))
+    finally:
+        process.join()
+    if result == 'error':
+        raise RuntimeError('Building the hints of world %d failed:\n%s' % (world_id + 1, message))
+    results[world_id] = message
+
+
+# Sends the hints and events of the world from a process of buildGossipHintsProcesses,
+# or the error building them raised.
+def buildWorldGossipHintsProcess(spoiler, worlds, checkedLocations, seed, world_id, connection):
+    try:
+        connection.send(('success', buildWorldGossipHintsAlone(spoiler, worlds[world_id], checkedLocations, seed)))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+
+
+# Builds the hints of the world from a copy of the spoiler, worlds and hint searches,
+# which leaves these as they were, like a forked process does.
+def buildWorldGossipHintsCopy(spoiler, worlds, checkedLocations, seed, world_id):
+    global hint_searches
+    saved_searches = hint_searches
+    spoiler, worlds, hint_searches = copy.deepcopy((spoiler, worlds, hint_searches))
+    try:
+        return buildWorldGossipHintsAlone(spoiler, worlds[world_id], checkedLocations, seed)
+    finally:
+        hint_searches = saved_searches
+
+
+# Returns the hints of the world, and the stones and hinted locations of their events.
+def buildWorldGossipHintsAlone(spoiler, world, checkedLocations, seed):
+    global hint_events
+    random.seed('%d-%d' % (seed, world.id))
+    hint_events = []
+    try:
+        buildWorldGossipHints(spoiler, world, set(checkedLocations.get(world.id, ())))
+        return spoiler.hints[world.id], [(stone_names, [(location.world.id, location.name) for location in locations])
+                                         for stone_names, locations, _ in hint_events]
+    finally:
+        hint_events = None
 
 
 # builds out general hints based on location and whether an item is required or not
@@ -1091,7 +1305,7 @@ def buildWorldGossipHints(spoiler, world, checkedLocations=None):
     world.barren_dungeon = 0
     world.woth_dungeon = 0
 
-    search = Search.max_explore([w.state for w in spoiler.worlds])
+    search = get_hint_search(spoiler.worlds)
     for stone in gossipLocations.values():
         stone.reachable = (
             search.spot_access(world.get_location(stone.location))
@@ -21,6 +21,10 @@ class Location(object):
         self.staleness_count = 0
         self.access_rule = lambda state, **kwargs: True
         self.access_rules = []
+        # Item names read by the access rule, or None if unknown
+        self.dependencies = frozenset()
+        # Whether the access rule also reads the search, eg. for time of day
+        self.reads_search = False
         self.item_rule = lambda location, item: True
         self.locked = False
         self.price = None
@@ -43,6 +47,8 @@ class Location(object):
             new_location.item.location = new_location
         new_location.access_rule = self.access_rule
         new_location.access_rules = list(self.access_rules)
+        new_location.dependencies = self.dependencies
+        new_location.reads_search = self.reads_search
         new_location.item_rule = self.item_rule
         new_location.locked = self.locked
         new_location.internal = self.internal
@@ -68,11 +74,19 @@ class Location(object):
             return
         self.access_rules.append(lambda_rule)
         self.access_rule = lambda state, **kwargs: all(rule(state, **kwargs) for rule in self.access_rules)
+        rule_dependencies = getattr(lambda_rule, 'dependencies', None)
+        if self.dependencies is None or rule_dependencies is None:
+            self.dependencies = None
+        else:
+            self.dependencies = self.dependencies | rule_dependencies
+        self.reads_search = self.reads_search or getattr(lambda_rule, 'reads_search', True)
 
 
     def set_rule(self, lambda_rule):
         self.access_rule = lambda_rule
         self.access_rules = [lambda_rule]
+        self.dependencies = getattr(lambda_rule, 'dependencies', None)
+        self.reads_search = getattr(lambda_rule, 'reads_search', True)
 
 
     def can_fill(self, state, item, check_access=True):
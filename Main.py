@@ -1,9 +1,12 @@
 from collections import OrderedDict
+import concurrent.futures
 import copy
 import hashlib
 import io
 import itertools
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import platform
 import random
@@ -12,11 +15,12 @@ import subprocess
 import sys
 import struct
 import time
+import traceback
 import zipfile
 
 from World import World
 from Spoiler import Spoiler
-from Rom import Rom
+from Rom import Rom, RangeSet
 from Patches import patch_rom
 from Cosmetics import patch_cosmetics
 from Dungeon import create_dungeons
@@ -30,12 +34,18 @@ from N64Patch import create_patch_file, apply_patch_file
 from MBSDIFFPatch import apply_ootr_3_web_patch
 from SettingsList import setting_infos, logic_tricks
 from Rules import set_rules, set_shop_rules
+from Settings import Settings
 from Plandomizer import Distribution
 from Search import Search, RewindableSearch
 from EntranceShuffle import set_entrances
 from LocationList import set_drop_location_names
 from Goals import update_goal_items, maybe_set_misc_item_hints, replace_goal_names
 from version import __version__
+from Yaz0 import compress_rom_data
+
+
+# Base ROMs by path, kept loaded by processes that generate many seeds if set to a dict.
+base_roms = None
 
 
 class dummy_window():
@@ -52,27 +62,173 @@ def main(settings, window=dummy_window(), max_attempts=10):
     logger = logging.getLogger('')
     start = time.process_time()
 
+    # Workers start from the settings as they are before being resolved.
+    settings_json = settings.to_json_full() if settings.parallel_attempts > 1 else None
     rom = resolve_settings(settings, window=window)
 
     max_attempts = max(max_attempts, 1)
     spoiler = None
-    for attempt in range(1, max_attempts + 1):
-        try:
-            spoiler = generate(settings, window=window)
-            break
-        except ShuffleError as e:
-            logger.warning('Failed attempt %d of %d: %s', attempt, max_attempts, e)
-            if attempt >= max_attempts:
-                raise
-            else:
-                logger.info('Retrying...\n\n')
-            settings.reset_distribution()
+    if settings_json is not None:
+        spoiler = run_parallel_attempts(settings, settings_json, window, max_attempts)
+    else:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                spoiler = generate(settings, window=window)
+                break
+            except ShuffleError as e:
+                logger.warning('Failed attempt %d of %d: %s', attempt, max_attempts, e)
+                if attempt >= max_attempts:
+                    raise
+                else:
+                    logger.info('Retrying...\n\n')
+                settings.reset_distribution()
     patch_and_output(settings, window, spoiler, rom)
     logger.debug('Total Time: %s', time.process_time() - start)
     return spoiler
 
 
-def resolve_settings(settings, window=dummy_window()):
+# Generates the first attempt in this process while up to settings.parallel_attempts - 1
+# worker processes try the next ones, and returns the spoiler of the first attempt, in order,
+# that doesn't raise a ShuffleError. Spoilers can't be sent between processes, so an attempt
+# a worker found to succeed is generated again here, which its seed makes the same attempt.
+# As each attempt has its own seed, this is the same attempt however many run at the same time.
+def run_parallel_attempts(settings, settings_json, window, max_attempts):
+    logger = logging.getLogger('')
+    running = {}
+    errors = {}
+    next_attempt = 2
+
+    def start_attempts(count):
+        nonlocal next_attempt
+        while len(running) < count and next_attempt <= max_attempts:
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_attempt,
+                    args=(settings_json, next_attempt, logger.getEffectiveLevel(), worker_connection))
+            process.start()
+            worker_connection.close()
+            running[connection] = (next_attempt, process)
+            next_attempt += 1
+
+    try:
+        # This process takes one of the attempts while it generates the first one.
+        start_attempts(settings.parallel_attempts - 1)
+        try:
+            return generate(settings, window=window)
+        except ShuffleError as e:
+            logger.warning('Failed attempt %d of %d: %s', 1, max_attempts, e)
+            error = str(e)
+        for attempt in range(2, max_attempts + 1):
+            while attempt not in errors:
+                start_attempts(settings.parallel_attempts)
+                for connection in multiprocessing.connection.wait(list(running)):
+                    other_attempt, process = running.pop(connection)
+                    try:
+                        errors[other_attempt] = receive_from_attempt(connection)
+                    finally:
+                        process.join()
+            if errors[attempt] is None:
+                break
+            logger.warning('Failed attempt %d of %d: %s', attempt, max_attempts, errors[attempt])
+            error = errors[attempt]
+        else:
+            raise ShuffleError(error)
+    finally:
+        # The attempts that are still generating aren't needed anymore.
+        for _, process in running.values():
+            process.terminate()
+        for _, process in running.values():
+            process.join()
+
+    logger.info('Generating attempt %d of %d again.', attempt, max_attempts)
+    settings.reset_distribution()
+    clearHintExclusionCache()
+    seed_attempt(settings, attempt)
+    return generate(settings, window=window)
+
+
+# Returns None if the attempt succeeded or the error if it raised a ShuffleError,
+# and raises if it failed in any other way.
+def receive_from_attempt(connection):
+    try:
+        result, message = connection.recv()
+    except EOFError:
+        raise RuntimeError('A generation attempt exited unexpectedly.')
+    if result == 'error':
+        raise RuntimeError('A generation attempt failed:\n%s' % message)
+    return message
+
+
+# Generates one attempt in a worker process and sends whether it succeeded.
+def run_attempt(settings_json, attempt, loglevel, connection):
+    init_job(loglevel)
+    clearHintExclusionCache()
+    try:
+        settings = Settings(settings_json)
+        resolve_settings(settings, load_rom=False)
+        seed_attempt(settings, attempt)
+        try:
+            generate(settings)
+        except ShuffleError as e:
+            connection.send(('failed', str(e)))
+            return
+        connection.send(('success', None))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+
+
+# The first attempt uses the random state left by resolving the settings, like serial
+# attempts do, and the others are seeded from the numeric seed and their number.
+def seed_attempt(settings, attempt):
+    if attempt > 1:
+        random.seed('%d-%d' % (settings.numeric_seed, attempt))
+
+
+# Generates settings.count seeds, up to settings.jobs at a time, each in a worker process
+# so that seeds share no module state or random number generator.
+# Logs the result of each seed as it finishes and raises if any failed.
+def main_jobs(settings):
+    logger = logging.getLogger('')
+    settings_json = settings.to_json_full()
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(settings.jobs, settings.count),
+            initializer=init_job, initargs=(logger.getEffectiveLevel(),)) as executor:
+        jobs = []
+        for i in range(settings.count):
+            job_settings = dict(settings_json)
+            # Seeds running at the same time can't write to the same files.
+            if settings.output_file:
+                job_settings['output_file'] = '%s-%d' % (settings.output_file, i)
+            jobs.append(executor.submit(generate_job, job_settings, settings.seed + '-' + str(i)))
+        for job in concurrent.futures.as_completed(jobs):
+            seed, output_path, error, elapsed = job.result()
+            if error is None:
+                logger.info('Seed %s done in %.2fs: %s', seed, elapsed, output_path)
+            else:
+                failures += 1
+                logger.error('Seed %s failed after %.2fs:\n%s', seed, elapsed, error)
+    if failures:
+        raise Exception('%d of %d seeds failed' % (failures, settings.count))
+
+
+def init_job(loglevel):
+    # Only the results of each seed are logged by default, as output from the workers would interleave.
+    logging.getLogger('').setLevel(max(loglevel, logging.WARNING))
+
+
+# Returns the seed, the base path of its output files, the error if it failed, and the time it took.
+def generate_job(settings_json, seed):
+    start = time.perf_counter()
+    settings = Settings(settings_json)
+    settings.update_seed(seed)
+    try:
+        main(settings)
+    except Exception:
+        return settings.seed, None, traceback.format_exc(), time.perf_counter() - start
+    output_path = os.path.join(default_output_path(settings.output_dir), get_output_filename_base(settings))
+    return settings.seed, output_path, None, time.perf_counter() - start
+
+
+def resolve_settings(settings, window=dummy_window(), load_rom=True):
     logger = logging.getLogger('')
 
     old_tricks = settings.allowed_tricks
@@ -92,9 +248,9 @@ def resolve_settings(settings, window=dummy_window()):
     if not (using_rom or settings.patch_without_output) and not settings.create_spoiler:
         raise Exception('You must have at least one output type or spoiler log enabled to produce anything.')
 
-    if using_rom:
+    if using_rom and load_rom:
         window.update_status('Loading ROM')
-        rom = Rom(settings.rom)
+        rom = load_base_rom(settings.rom)
     else:
         rom = None
 
@@ -124,6 +280,17 @@ def resolve_settings(settings, window=dummy_window()):
     return rom
 
 
+# Loads the base ROM, or restores the one kept in base_roms.
+def load_base_rom(path):
+    if base_roms is None:
+        return Rom(path)
+    if path in base_roms:
+        base_roms[path].restore()
+    else:
+        base_roms[path] = Rom(path)
+    return base_roms[path]
+
+
 def generate(settings, window=dummy_window()):
     worlds = build_world_graphs(settings, window=window)
     place_items(settings, worlds, window=window)
@@ -250,10 +417,17 @@ def compress_rom(input_file, output_file, window=dummy_window(), delete_input=Fa
         else:
             compressor_path += "Compress.out"
     else:
-        logger.info("OS not supported for ROM compression.")
-        raise Exception("This operating system does not support ROM compression. You may only output patch files or uncompressed ROMs.")
+        compressor_path = None
 
-    run_process(window, logger, [compressor_path, input_file, output_file])
+    if compressor_path is not None and os.path.isfile(compressor_path):
+        run_process(window, logger, [compressor_path, input_file, output_file])
+    else:
+        # Without a compressor binary for this system, fall back to the much slower Python one.
+        logger.info("No ROM compressor found for this system, compressing in Python.")
+        with open(input_file, 'rb') as infile:
+            data = infile.read()
+        with open(output_file, 'wb') as outfile:
+            outfile.write(compress_rom_data(data))
     if delete_input:
         os.remove(input_file)
 
@@ -297,11 +471,7 @@ def generate_wad(wad_file, rom_file, output_file, channel_title, channel_id, win
         os.remove(rom_file)
 
 
-def patch_and_output(settings, window, spoiler, rom):
-    logger = logging.getLogger('')
-    worlds = spoiler.worlds
-    cosmetics_log = None
-
+def get_output_filename_base(settings):
     settings_string_hash = hashlib.sha1(settings.settings_string.encode('utf-8')).hexdigest().upper()[:5]
     if settings.output_file:
         output_filename_base = settings.output_file
@@ -309,7 +479,15 @@ def patch_and_output(settings, window, spoiler, rom):
         output_filename_base = f"OoT_{settings_string_hash}_{settings.seed}"
         if settings.world_count > 1:
             output_filename_base += f"_W{settings.world_count}"
+    return output_filename_base
+
+
+def patch_and_output(settings, window, spoiler, rom):
+    logger = logging.getLogger('')
+    worlds = spoiler.worlds
+    cosmetics_log = None
 
+    output_filename_base = get_output_filename_base(settings)
     output_dir = default_output_path(settings.output_dir)
 
     compressed_rom = settings.create_compressed_rom or settings.create_wad_file
@@ -570,7 +748,7 @@ def cosmetic_patch(settings, window=dummy_window()):
 
     # clear changes from the base patch file
     patched_base_rom = copy.copy(rom.buffer)
-    rom.changed_address = {}
+    rom.changed_ranges = RangeSet()
     rom.changed_dma = {}
     rom.force_patch = []
 
@@ -734,7 +912,8 @@ def create_playthrough(spoiler):
     # Reduce each entrance sphere in reverse order, by checking if the game is beatable when we disconnect the entrance.
     required_entrances = []
     for sphere in reversed(entrance_spheres):
-        for entrance in sphere:
+        # in a fixed order, as which entrances end up required depends on it
+        for entrance in sorted(sphere, key=lambda entrance: (entrance.world.id, entrance.name)):
             # we disconnect the entrance and check if the game is still beatable
             old_connected_region = entrance.disconnect()
 
@@ -1,5 +1,6 @@
 # text details: https://wiki.cloudmodding.com/oot/Text_Format
 
+import copy
 import random
 from HintList import misc_item_hint_table
 from TextBox import line_wrap
@@ -442,18 +443,6 @@ class Text_Code:
             size += CONTROL_CODES[self.code][1]
         return size
 
-    # writes the code to the given offset, and returns the offset of the next byte
-    def write(self, rom, offset):
-        rom.write_byte(TEXT_START + offset, self.code)
-
-        extra_bytes = 0
-        if self.code in CONTROL_CODES:
-            extra_bytes = CONTROL_CODES[self.code][1]
-            bytes_to_write = int_to_bytes(self.data, extra_bytes)
-            rom.write_bytes(TEXT_START + offset + 1, bytes_to_write)
-
-        return offset + 1 + extra_bytes
-
     def __init__(self, code, data):
         self.code = code
         if code in CONTROL_CODES:
@@ -595,24 +584,19 @@ class Message:
 
         self.text_codes = text_codes
 
-    # writes a Message back into the rom, using the given index and offset to update the table
-    # returns the offset of the next message
-    def write(self, rom, index, offset):
-        # construct the table entry
-        id_bytes = int_to_bytes(self.id, 2)
-        offset_bytes = int_to_bytes(offset, 3)
-        entry = id_bytes + bytes([self.opts, 0x00, 0x07]) + offset_bytes
-        # write it back
-        entry_offset = EXTENDED_TABLE_START + 8 * index
-        rom.write_bytes(entry_offset, entry)
+    # the message table entry of the Message, for its text at the given offset
+    def get_table_entry(self, offset):
+        return int_to_bytes(self.id, 2) + bytes([self.opts, 0x00, 0x07]) + int_to_bytes(offset, 3)
 
+    # the text codes as they are written to the rom, padded to 4 byte align
+    def get_bytes(self):
+        data = bytearray()
         for code in self.text_codes:
-            offset = code.write(rom, offset)
-
-        while offset % 4 > 0:
-            offset = Text_Code(0x00, 0).write(rom, offset) # pad to 4 byte align
-
-        return offset
+            data.append(code.code)
+            if code.code in CONTROL_CODES:
+                data += int_to_bytes(code.data, CONTROL_CODES[code.code][1])
+        data += bytes(-len(data) % 4)
+        return data
 
 
     def __init__(self, raw_text, index, id, opts, offset, length):
@@ -890,11 +874,17 @@ def add_item_messages(messages, shop_items, world):
     update_item_messages(messages, world)
 
 
+# The messages read_messages parsed last, with the bytes of the table and text they were parsed from.
+# Every world reads the same messages from the base rom, so they are only parsed again if those changed.
+read_messages_cache = None
+
 # reads each of the game's messages into a list of Message objects
 def read_messages(rom):
+    global read_messages_cache
+
     table_offset = ENG_TABLE_START
     index = 0
-    messages = []
+    text_end = 0
     while True:
         entry = rom.read_bytes(table_offset, 8)
         id = bytes_to_int(entry[0:2])
@@ -905,12 +895,18 @@ def read_messages(rom):
         if id == 0xFFFF:
             break # this marks the end of the table
 
-        messages.append( Message.from_rom(rom, index) )
-
+        # each message's text ends where the next entry's text starts
+        text_end = max(text_end, bytes_to_int(rom.read_bytes(table_offset + 13, 3)))
         index += 1
         table_offset += 8
 
-    return messages
+    data = (rom.read_bytes(ENG_TABLE_START, table_offset - ENG_TABLE_START), rom.read_bytes(TEXT_START, text_end))
+    if read_messages_cache is None or read_messages_cache[0] != data:
+        read_messages_cache = (data, [Message.from_rom(rom, i) for i in range(index)])
+
+    # The messages are changed when patching, so each rom gets its own copies.
+    # Their text codes are only ever replaced, so they are shared.
+    return [copy.copy(message) for message in read_messages_cache[1]]
 
 # write the messages back
 def repack_messages(rom, messages, permutation=None, always_allow_skip=True, speed_up_text=True):
@@ -920,8 +916,9 @@ def repack_messages(rom, messages, permutation=None, always_allow_skip=True, spe
     if permutation is None:
         permutation = range(len(messages))
 
-    # repack messages
-    offset = 0
+    # repack messages, into one block for the table and one for the text
+    table = bytearray()
+    text = bytearray()
     text_size_limit = ENG_TEXT_SIZE_LIMIT
 
     for old_index, new_index in enumerate(permutation):
@@ -933,11 +930,15 @@ def repack_messages(rom, messages, permutation=None, always_allow_skip=True, spe
         # modify message, making it represent how we want it to be written
         new_message.transform(True, old_message.ending, always_allow_skip, speed_up_text)
 
-        # actually write the message
-        offset = new_message.write(rom, old_index, offset)
+        table += new_message.get_table_entry(len(text))
+        text += new_message.get_bytes()
 
         new_message.id = remember_id
 
+    rom.write_bytes(EXTENDED_TABLE_START, table)
+    rom.write_bytes(TEXT_START, text)
+    offset = len(text)
+
     # raise an exception if too much is written
     # we raise it at the end so that we know how much overflow there is
     if offset > text_size_limit:
@@ -1,7 +1,12 @@
 #Much of this is heavily inspired from and/or based on az64's / Deathbasket's MM randomizer
 
-import random
+from collections import OrderedDict
+import contextlib
+import logging
+import json
 import os
+import random
+import tempfile
 from Utils import compare_version, data_path
 
 
@@ -113,7 +118,86 @@ class Sequence(object):
         self.data = []
 
 
-def process_sequences(rom, sequences, target_sequences, disabled_source_sequences, disabled_target_sequences, ids, seq_type = 'bgm'):
+# The lines of each .meta file in data/Music/, by path, with the mtime and size they were read at.
+# The index is kept for the rest of the process, and saved in data/Music/ for the next ones,
+# so only the .meta files that changed are read again.
+MUSIC_INDEX_FILE = os.path.join(u'./data/Music', u'.music_index.json')
+music_index = None
+
+# The most recently read .seq files, by path, with the mtime and size they were read at.
+sequence_data_cache = OrderedDict()
+sequence_data_cache_size = 256
+
+
+# Returns the directory, .meta file name and .meta lines of every custom sequence in data/Music/.
+def read_music_index():
+    global music_index
+    if music_index is None:
+        # Music packs can put anything in data/Music/, so an index that can't be read is only rebuilt.
+        try:
+            with open(MUSIC_INDEX_FILE, 'r', encoding='utf-8') as stream:
+                music_index = {path: ((mtime, size), [str(line) for line in lines])
+                               for path, ((mtime, size), lines) in json.load(stream).items()}
+        except Exception:
+            music_index = {}
+
+    custom_sequences = []
+    found = set()
+    changed = False
+    for dirpath, _, filenames in os.walk(u'./data/Music', followlinks=True):
+        for fname in filenames:
+            # Find meta file and check if corresponding seq file exists
+            if fname.endswith('.meta') and os.path.isfile(os.path.join(dirpath, fname.split('.')[0] + '.seq')):
+                path = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(path)
+                    version = (stat.st_mtime_ns, stat.st_size)
+                    if path not in music_index or music_index[path][0] != version:
+                        with open(path, 'r') as stream:
+                            lines = stream.readlines()
+                        # Strip newline(s)
+                        music_index[path] = (version, [line.rstrip() for line in lines])
+                        changed = True
+                except FileNotFoundError as ex:
+                    raise FileNotFoundError('No meta file for: "' + fname + '". This should never happen')
+                found.add(path)
+                custom_sequences.append((dirpath, fname, music_index[path][1]))
+
+    for path in music_index.keys() - found:
+        del music_index[path]
+        changed = True
+    if changed and os.path.isdir(u'./data/Music'):
+        temp_path = None
+        try:
+            # Write to a temporary file first, so other processes never read a partial index.
+            fd, temp_path = tempfile.mkstemp(dir=u'./data/Music')
+            with os.fdopen(fd, 'w', encoding='utf-8') as stream:
+                json.dump(music_index, stream)
+            os.replace(temp_path, MUSIC_INDEX_FILE)
+        except OSError as e:
+            logging.getLogger('').debug('Could not write music index %s: %s', MUSIC_INDEX_FILE, e)
+        finally:
+            # A failed write must not leave its temporary file behind.
+            if temp_path is not None and os.path.exists(temp_path):
+                with contextlib.suppress(OSError):
+                    os.remove(temp_path)
+    return custom_sequences
+
+
+# Returns the data of a .seq file, which is only read again if its mtime or size changed.
+def read_sequence_file(path):
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if path not in sequence_data_cache or sequence_data_cache[path][0] != version:
+        with open(path, 'rb') as stream:
+            sequence_data_cache[path] = (version, stream.read())
+        if len(sequence_data_cache) > sequence_data_cache_size:
+            sequence_data_cache.popitem(last=False)
+    sequence_data_cache.move_to_end(path)
+    return bytearray(sequence_data_cache[path][1])
+
+
+def process_sequences(rom, sequences, target_sequences, disabled_source_sequences, disabled_target_sequences, ids, seq_type = 'bgm', custom_sequences = None):
     # Process vanilla music data
     for bgm in ids:
         # Get sequence metadata
@@ -145,32 +229,22 @@ def process_sequences(rom, sequences, target_sequences, disabled_source_sequence
     # Process music data in data/Music/
     # Each sequence requires a valid .seq sequence file and a .meta metadata file
     # Current .meta format: Cosmetic Name\nInstrument Set\nPool
-    for dirpath, _, filenames in os.walk(u'./data/Music', followlinks=True):
-        for fname in filenames:
-            # Skip if included in exclusion file
-            if fname in seq_exclusion_list:
-                continue
-
-            # Find meta file and check if corresponding seq file exists
-            if fname.endswith('.meta') and os.path.isfile(os.path.join(dirpath, fname.split('.')[0] + '.seq')):
-                # Read meta info
-                try:
-                    with open(os.path.join(dirpath, fname), 'r') as stream:
-                        lines = stream.readlines()
-                    # Strip newline(s)
-                    lines = [line.rstrip() for line in lines]
-                except FileNotFoundError as ex:
-                    raise FileNotFoundError('No meta file for: "' + fname + '". This should never happen')
+    if custom_sequences is None:
+        custom_sequences = read_music_index()
+    for dirpath, fname, lines in custom_sequences:
+        # Skip if included in exclusion file
+        if fname in seq_exclusion_list:
+            continue
 
-                # Create new sequence, checking third line for correct type
-                if (len(lines) > 2 and (lines[2].lower() == seq_type.lower() or lines[2] == '')) or (len(lines) <= 2 and seq_type == 'bgm'):
-                    seq = TableEntry(os.path.join(dirpath, fname.split('.')[0]), lines[0], instrument_set = int(lines[1], 16))
+        # Create new sequence, checking third line for correct type
+        if (len(lines) > 2 and (lines[2].lower() == seq_type.lower() or lines[2] == '')) or (len(lines) <= 2 and seq_type == 'bgm'):
+            seq = TableEntry(os.path.join(dirpath, fname.split('.')[0]), lines[0], instrument_set = int(lines[1], 16))
 
-                    if seq.instrument_set < 0x00 or seq.instrument_set > 0x25:
-                        raise Exception('Sequence instrument must be in range [0x00, 0x25]')
+            if seq.instrument_set < 0x00 or seq.instrument_set > 0x25:
+                raise Exception('Sequence instrument must be in range [0x00, 0x25]')
 
-                    if seq.cosmetic_name not in disabled_source_sequences:
-                        sequences.append(seq)
+            if seq.cosmetic_name not in disabled_source_sequences:
+                sequences.append(seq)
 
     return sequences, target_sequences
 
@@ -260,8 +334,7 @@ def rebuild_sequences(rom, sequences):
             else:
                 # Read sequence info
                 try:
-                    with open(s.name + '.seq', 'rb') as stream:
-                        new_entry.data = bytearray(stream.read())
+                    new_entry.data = read_sequence_file(s.name + '.seq')
                     new_entry.size = len(new_entry.data)
                     if new_entry.size <= 0x10:
                         raise Exception('Invalid sequence file "' + s.name + '.seq"')
@@ -423,14 +496,15 @@ def randomize_music(rom, settings, music_mapping):
         errors.append("Custom music is disabled when creating patch files. Only randomizing vanilla music.")
 
     if custom_sequences_enabled:
+        custom_sequences = read_music_index()
         if settings.background_music in ['random', 'random_custom_only'] or bgm_mapped:
-            process_sequences(rom, sequences, target_sequences, disabled_source_sequences, disabled_target_sequences, bgm_ids)
+            process_sequences(rom, sequences, target_sequences, disabled_source_sequences, disabled_target_sequences, bgm_ids, custom_sequences=custom_sequences)
             if settings.background_music == 'random_custom_only':
                 sequences = [seq for seq in sequences if seq.cosmetic_name not in [x[0] for x in bgm_ids] or seq.cosmetic_name in music_mapping.values()]
             sequences, log = shuffle_music(sequences, target_sequences, music_mapping, log)
 
         if settings.fanfares in ['random', 'random_custom_only'] or ff_mapped or ocarina_mapped:
-            process_sequences(rom, fanfare_sequences, fanfare_target_sequences, disabled_source_sequences, disabled_target_sequences, ff_ids, 'fanfare')
+            process_sequences(rom, fanfare_sequences, fanfare_target_sequences, disabled_source_sequences, disabled_target_sequences, ff_ids, 'fanfare', custom_sequences)
             if settings.fanfares == 'random_custom_only':
                 fanfare_sequences = [seq for seq in fanfare_sequences if seq.cosmetic_name not in [x[0] for x in fanfare_sequence_ids] or seq.cosmetic_name in music_mapping.values()]
             fanfare_sequences, log = shuffle_music(fanfare_sequences, fanfare_target_sequences, music_mapping, log)
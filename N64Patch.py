@@ -1,74 +1,140 @@
 import struct
 import random
 import io
+import operator
+import re
 import array
 import zlib
 import copy
 import zipfile
 from ntype import BigStream
+from Rom import RomBuffer
 
 
-# get the next XOR key. Uses some location in the source rom.
-# This will skip of 0s, since if we hit a block of 0s, the
-# patch data will be raw.
-def key_next(rom, key_address, address_range):
-    key = 0
-    while key == 0:
-        key_address += 1
-        if key_address > address_range[1]:
-            key_address = address_range[0]
-        key = rom.original.buffer[key_address]
-    return key, key_address
+# The XOR keys of a patch: the non-zero bytes of the xor_range of the source
+# rom, cycled through from the one after xor_address. Skipping the 0s means
+# the patch data won't be raw, even if we hit a block of 0s.
+class XorKeys(object):
+
+    def __init__(self, rom, xor_range, xor_address):
+        source = bytes(rom.original.buffer[xor_range[0]:xor_range[1]+1])
+        self.keys = source.replace(b'\x00', b'')
+        # the next key is the first non-zero byte after xor_address
+        preceding = source[:xor_address - xor_range[0] + 1]
+        self.index = (len(preceding) - preceding.count(0)) % len(self.keys)
+
+
+    # get the next count XOR keys, without using them
+    def peek(self, count):
+        keys = self.keys[self.index:self.index + count]
+        while len(keys) < count:
+            keys += self.keys[:count - len(keys)]
+        return keys
+
+
+    def skip(self, count):
+        self.index = (self.index + count) % len(self.keys)
+
+
+    def next(self):
+        key = self.keys[self.index]
+        self.skip(1)
+        return key
+
+
+    # XOR the non-zero bytes of data with the next keys. 0s are left as 0s.
+    def xor(self, data):
+        nonzero = data.replace(b'\x00', b'')
+        xored = xor_bytes(nonzero, self.peek(len(nonzero)))
+        self.skip(len(nonzero))
+        return scatter_nonzero(data, xored)
+
+
+def xor_bytes(a, b):
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
+# Replace the non-zero bytes of data, in order, with the given values.
+def scatter_nonzero(data, values):
+    result = bytearray(data)
+    offset = 0
+    for run in re.finditer(b'[^\x00]+', data):
+        run_start, run_end = run.span()
+        result[run_start:run_end] = values[offset:offset + run_end - run_start]
+        offset += run_end - run_start
+    return result
+
+
+# Returns the index of the count-th (from 0) non-zero byte of data.
+def find_nonzero(data, count):
+    for run in re.finditer(b'[^\x00]+', data):
+        if count < run.end() - run.start():
+            return run.start() + count
+        count -= run.end() - run.start()
+    return len(data)
 
 
 # creates a XOR block for the patch. This might break it up into
 # multiple smaller blocks if there is a concern about the XOR key
 # or if it is too long.
-def write_block(rom, xor_address, xor_range, block_start, data, patch_data):
-    new_data = []
+def write_block(xor_keys, block_start, data, patch_data):
+    new_data = bytearray()
     key_offset = 0
     continue_block = False
 
-    for b in data:
-        if b == 0:
-            # Leave 0s as 0s. Do not XOR
-            new_data += [0]
+    data = bytes(data)
+    position = 0
+    while position < len(data):
+        # XOR as much as fits in the block at once, up to the first byte
+        # equal to its XOR key, since it would result in 0. That happens
+        # every few hundred bytes, so don't XOR too far ahead.
+        chunk = data[position:position + min(0xFFFF - len(new_data), 0x400)]
+        nonzero = chunk.replace(b'\x00', b'')
+        xored = xor_bytes(nonzero, xor_keys.peek(len(nonzero)))
+        safe_count = xored.find(0)
+        if safe_count < 0:
+            safe_count = len(nonzero)
         else:
-            # get the next XOR key
-            key, xor_address = key_next(rom, xor_address, xor_range)
+            # cut the chunk right before the unsafe byte
+            chunk = chunk[:find_nonzero(chunk, safe_count)]
+        new_data += scatter_nonzero(chunk, xored[:safe_count])
+        xor_keys.skip(safe_count)
+        position += len(chunk)
 
+        if safe_count < len(nonzero):
             # if the XOR would result in 0, change the key.
             # This requires breaking up the block.
-            if b == key:
-                write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-                new_data = []
-                key_offset = 0
-                continue_block = True
-
-                # search for next safe XOR key
-                while b == key:
-                    key_offset += 1
-                    key, xor_address = key_next(rom, xor_address, xor_range)
-                    # if we aren't able to find one quickly, we may need to break again
-                    if key_offset == 0xFF:
-                        write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-                        new_data = []
-                        key_offset = 0
-                        continue_block = True
+            b = data[position]
+            key = xor_keys.next()
+            write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
+            new_data = bytearray()
+            key_offset = 0
+            continue_block = True
+
+            # search for next safe XOR key
+            while b == key:
+                key_offset += 1
+                key = xor_keys.next()
+                # if we aren't able to find one quickly, we may need to break again
+                if key_offset == 0xFF:
+                    write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
+                    new_data = bytearray()
+                    key_offset = 0
+                    continue_block = True
 
             # XOR the key with the byte
-            new_data += [b ^ key]
+            new_data.append(b ^ key)
+            position += 1
 
-            # Break the block if it's too long
-            if (len(new_data) == 0xFFFF):
-                write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-                new_data = []
-                key_offset = 0
-                continue_block = True
+        # Break the block if it's too long
+        if len(new_data) == 0xFFFF and (new_data[-1] != 0 or position < len(data)):
+            write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
+            new_data = bytearray()
+            key_offset = 0
+            continue_block = True
 
     # Save the block
     write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-    return xor_address
 
 
 # This saves a sub-block for the XOR block. If it's the first part
@@ -92,7 +158,7 @@ def create_patch_file(rom, file, xor_range=(0x00B8AD30, 0x00F029A0)):
     dma_start, dma_end = rom.get_dma_table_range()
 
     # add header
-    patch_data = BigStream([])
+    patch_data = BigStream(bytearray())
     patch_data.append_bytes(list(map(ord, 'ZPFv1')))
     patch_data.append_int32(dma_start)
     patch_data.append_int32(xor_range[0])
@@ -103,7 +169,7 @@ def create_patch_file(rom, file, xor_range=(0x00B8AD30, 0x00F029A0)):
     xor_address = random.Random().randint(*xor_range)
     patch_data.append_int32(xor_address)
 
-    new_buffer = copy.copy(rom.original.buffer)
+    new_buffer = RomBuffer(rom.original.buffer)
 
     # write every changed DMA entry
     for dma_index, (from_file, start, size) in rom.changed_dma.items():
@@ -115,55 +181,61 @@ def create_patch_file(rom, file, xor_range=(0x00B8AD30, 0x00F029A0)):
         # We don't trust files that have modified DMA to have their
         # changed addresses tracked correctly, so we invalidate the
         # entire file
-        for address in range(start, start + size):
-            rom.changed_address[address] = rom.buffer[address]
+        rom.changed_ranges.add(start, start + size)
 
         # Simulate moving the files to know which addresses have changed
         if from_file >= 0:
             old_dma_start, old_dma_end, old_size = rom.original.get_dmadata_record_by_key(from_file)
             copy_size = min(size, old_size)
             new_buffer[start:start+copy_size] = rom.original.read_bytes(from_file, copy_size)
-            new_buffer[start+copy_size:start+size] = [0] * (size - copy_size)
+            new_buffer[start+copy_size:start+size] = bytes(size - copy_size)
         else:
             # this is a new file, so we just fill with null data
-            new_buffer[start:start+size] = [0] * size
+            new_buffer[start:start+size] = bytes(size)
 
     # end of DMA entries
     patch_data.append_int16(0xFFFF)
 
-    # filter down the addresses that will actually need to change.
+    # filter down the addresses that will actually need to change, as runs of consecutive addresses.
     # Make sure to not include any of the DMA table addresses
-    changed_addresses = [address for address,value in rom.changed_address.items() \
-        if (address >= dma_end or address < dma_start) and \
-            (address in rom.force_patch or new_buffer[address] != value)]
-    changed_addresses.sort()
+    changed_runs = []
+    for changed_start, changed_end in rom.changed_ranges:
+        for start, end in ((changed_start, min(changed_end, dma_start)), (max(changed_start, dma_end), changed_end)):
+            if start >= end:
+                continue
+            changed = bytearray(map(operator.ne, rom.buffer[start:end], new_buffer[start:end]))
+            for address in rom.force_patch:
+                if start <= address < end:
+                    changed[address - start] = 1
+            changed_runs.extend((start + run.start(), start + run.end()) for run in re.finditer(b'\x01+', changed))
 
     # Write the address changes. We'll store the data with XOR so that
     # the patch data won't be raw data from the patched rom.
-    data = []
+    xor_keys = XorKeys(rom, xor_range, xor_address)
+    data = bytearray()
     block_start = None
     BLOCK_HEADER_SIZE = 7 # this is used to break up gaps
-    for address in changed_addresses:
+    for run_start, run_end in changed_runs:
         # if there's a block to write and there's a gap, write it
         if block_start:
             block_end = block_start + len(data) - 1
-            if address > block_end + BLOCK_HEADER_SIZE:
-                xor_address = write_block(rom, xor_address, xor_range, block_start, data, patch_data)
-                data = []
+            if run_start > block_end + BLOCK_HEADER_SIZE:
+                write_block(xor_keys, block_start, data, patch_data)
+                data = bytearray()
                 block_start = None
                 block_end = None
 
         # start a new block
         if not block_start:
-            block_start = address
-            block_end = address - 1             
+            block_start = run_start
+            block_end = run_start - 1
 
         # save the new data
-        data += rom.buffer[block_end+1:address+1]
+        data += rom.buffer[block_end+1:run_end]
 
     # if there was any left over blocks, write them out
     if block_start:
-        xor_address = write_block(rom, xor_address, xor_range, block_start, data, patch_data)
+        write_block(xor_keys, block_start, data, patch_data)
 
     # compress the patch file
     patch_data = bytes(patch_data.buffer)
@@ -231,12 +303,13 @@ def apply_patch_file(rom, file, sub_file=None):
             old_dma_start, old_dma_end, old_size = rom.original.get_dmadata_record_by_key(from_file)
             copy_size = min(size, old_size)
             rom.write_bytes(start, rom.original.read_bytes(from_file, copy_size))
-            rom.buffer[start+copy_size:start+size] = [0] * (size - copy_size)
+            rom.buffer[start+copy_size:start+size] = bytes(size - copy_size)
         else:
             # if it's a new file, fill with 0s
-            rom.buffer[start:start+size] = [0] * size
+            rom.buffer[start:start+size] = bytes(size)
 
     # Read in the XOR data blocks. This goes to the end of the file.
+    xor_keys = XorKeys(rom, xor_range, xor_address)
     block_start = None
     while not patch_data.eof():
         is_new_block = patch_data.read_byte() != 0xFF
@@ -251,19 +324,10 @@ def apply_patch_file(rom, file, sub_file=None):
             key_skip = patch_data.read_byte()
             block_size = patch_data.read_int16()
             # skip specified XOR keys
-            for _ in range(key_skip):
-                key, xor_address = key_next(rom, xor_address, xor_range)
-
-        # read in the new data
-        data = []
-        for b in patch_data.read_bytes(length=block_size):
-            if b == 0:
-                # keep 0s as 0s
-                data += [0]
-            else:
-                # The XOR will always be safe and will never produce 0
-                key, xor_address = key_next(rom, xor_address, xor_range)
-                data += [b ^ key]
+            xor_keys.skip(key_skip)
+
+        # read in the new data. The XOR will always be safe and will never produce 0
+        data = xor_keys.xor(bytes(patch_data.read_bytes(length=block_size)))
 
         # Save the new data to rom
         rom.write_bytes(block_start, data)
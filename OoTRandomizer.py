@@ -8,7 +8,8 @@ import datetime
 import sys
 
 from Gui import guiMain
-from Main import main, from_patch_file, cosmetic_patch, diff_roms
+from Main import main, main_jobs, from_patch_file, cosmetic_patch, diff_roms
+from Server import serve
 from Utils import check_version, VersionError, check_python_version, local_path
 from Settings import get_settings_from_command_line_args
 
@@ -21,7 +22,7 @@ class ArgumentDefaultsHelpFormatter(argparse.RawTextHelpFormatter):
 
 def start():
 
-    settings, gui, args_loglevel, no_log_file, diff_rom = get_settings_from_command_line_args()
+    settings, gui, args_loglevel, no_log_file, diff_rom, server = get_settings_from_command_line_args()
 
     # set up logger
     loglevel = {'error': logging.ERROR, 'info': logging.INFO, 'warning': logging.WARNING, 'debug': logging.DEBUG}[args_loglevel]
@@ -51,10 +52,14 @@ def start():
             guiMain()
         elif diff_rom:
             diff_roms(settings, diff_rom)
+        elif server:
+            serve(settings, server)
         elif settings.cosmetics_only:
             cosmetic_patch(settings)
         elif settings.patch_file != '':
             from_patch_file(settings)
+        elif settings.count != None and settings.count > 1 and settings.jobs > 1:
+            main_jobs(settings)
         elif settings.count != None and settings.count > 1:
             orig_seed = settings.seed
             for i in range(settings.count):
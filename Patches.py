@@ -4,10 +4,11 @@ import itertools
 import re
 import zlib
 import datetime
+import weakref
 from collections import defaultdict
 
 from World import World
-from Rom import Rom
+from Rom import Rom, RomBuffer, RangeSet
 from Spoiler import Spoiler
 from LocationList import business_scrubs
 from Hints import writeGossipStoneHints, buildAltarHints, \
@@ -2292,8 +2293,8 @@ chestTypeMap = {
 }
 
 
-def room_get_actors(rom, actor_func, room_data, scene, alternate=None):
-    actors = {}
+# Yields the address of each actor's id and of the actor, in the order the room lists them.
+def room_get_actors(rom, room_data, alternate=None):
     room_start = alternate if alternate else room_data
     command = 0
     while command != 0x14: # 0x14 = end header
@@ -2302,26 +2303,21 @@ def room_get_actors(rom, actor_func, room_data, scene, alternate=None):
             actor_count = rom.read_byte(room_data + 1)
             actor_list = room_start + (rom.read_int32(room_data + 4) & 0x00FFFFFF)
             for _ in range(0, actor_count):
-                actor_id = rom.read_int16(actor_list)
-                entry = actor_func(rom, actor_id, actor_list, scene)
-                if entry:
-                    actors[actor_list] = entry
+                yield actor_list, actor_list
                 actor_list = actor_list + 16
         if command == 0x18: # Alternate header list
             header_list = room_start + (rom.read_int32(room_data + 4) & 0x00FFFFFF)
             for alt_id in range(0,3):
                 header_data = room_start + (rom.read_int32(header_list) & 0x00FFFFFF)
                 if header_data != 0 and not alternate:
-                    actors.update(room_get_actors(rom, actor_func, header_data, scene, room_start))
+                    yield from room_get_actors(rom, header_data, room_start)
                 header_list = header_list + 4
         room_data = room_data + 8
-    return actors
 
 
-def scene_get_actors(rom, actor_func, scene_data, scene, alternate=None, processed_rooms=None):
+def scene_get_actors(rom, scene_data, alternate=None, processed_rooms=None):
     if processed_rooms == None:
-        processed_rooms = []
-    actors = {}
+        processed_rooms = set()
     scene_start = alternate if alternate else scene_data
     command = 0
     while command != 0x14: # 0x14 = end header
@@ -2333,36 +2329,82 @@ def scene_get_actors(rom, actor_func, scene_data, scene, alternate=None, process
                 room_data = rom.read_int32(room_list);
 
                 if not room_data in processed_rooms:
-                    actors.update(room_get_actors(rom, actor_func, room_data, scene))
-                    processed_rooms.append(room_data)
+                    yield from room_get_actors(rom, room_data)
+                    processed_rooms.add(room_data)
                 room_list = room_list + 8
         if command == 0x0E: #transition actor list
             actor_count = rom.read_byte(scene_data + 1)
             actor_list = scene_start + (rom.read_int32(scene_data + 4) & 0x00FFFFFF)
             for _ in range(0, actor_count):
-                actor_id = rom.read_int16(actor_list + 4)
-                entry = actor_func(rom, actor_id, actor_list, scene)
-                if entry:
-                    actors[actor_list] = entry
+                yield actor_list + 4, actor_list
                 actor_list = actor_list + 16
         if command == 0x18: # Alternate header list
             header_list = scene_start + (rom.read_int32(scene_data + 4) & 0x00FFFFFF)
             for alt_id in range(0,3):
                 header_data = scene_start + (rom.read_int32(header_list) & 0x00FFFFFF)
                 if header_data != 0 and not alternate:
-                    actors.update(scene_get_actors(rom, actor_func, header_data, scene, scene_start, processed_rooms))
+                    yield from scene_get_actors(rom, header_data, scene_start, processed_rooms)
                 header_list = header_list + 4
 
         scene_data = scene_data + 8
-    return actors
 
 
-def get_actor_list(rom, actor_func):
-    actors = {}
+# Reads a rom for scene_get_actors, keeping the addresses it read.
+class RecordingReader(object):
+
+    def __init__(self, rom):
+        self.rom = rom
+        self.reads = RangeSet()
+
+
+    def read_byte(self, address):
+        self.reads.add(address, address + 1)
+        return self.rom.read_byte(address)
+
+
+    def read_int32(self, address):
+        self.reads.add(address, address + 4)
+        return self.rom.read_int32(address)
+
+
+# The actors of each scene of the original rom, and the addresses read to find them:
+# its scene table entry, and its headers and room lists. Scenes whose bytes there
+# are still the original's use these, and only the others are walked again.
+original_actor_index = weakref.WeakKeyDictionary()
+
+def get_actor_index(rom):
     scene_table = 0x00B71440
-    for scene in range(0x00, 0x65):
-        scene_data = rom.read_int32(scene_table + (scene * 0x14));
-        actors.update(scene_get_actors(rom, actor_func, scene_data, scene))
+    if rom.original not in original_actor_index:
+        original_actor_index[rom.original] = []
+        for scene in range(0x00, 0x65):
+            reader = RecordingReader(rom.original)
+            scene_data = reader.read_int32(scene_table + (scene * 0x14))
+            actors = list(scene_get_actors(reader, scene_data))
+            original_actor_index[rom.original].append((list(reader.reads), actors))
+
+    buffer, original = rom.buffer, rom.original.buffer
+    # Only the pages written to since the buffer was the original can be different.
+    dirty_pages = buffer.dirty_pages if isinstance(buffer, RomBuffer) and buffer.original is original else None
+    for scene, (reads, original_actors) in enumerate(original_actor_index[rom.original]):
+        if all(buffer[start:end] == original[start:end] for start, end in reads
+               if dirty_pages is None or not dirty_pages.isdisjoint(range(start >> RomBuffer.page_bits, ((end - 1) >> RomBuffer.page_bits) + 1))):
+            actors = original_actors
+        else:
+            actors = scene_get_actors(rom, rom.read_int32(scene_table + (scene * 0x14)))
+        for actor_id_address, actor in actors:
+            yield scene, actor_id_address, actor
+
+
+# Calls actor_func on every actor of every scene, or only on those with one of actor_ids.
+# Actor ids are read from the rom as it is, as patches can change them.
+def get_actor_list(rom, actor_func, actor_ids=None):
+    actors = {}
+    for scene, actor_id_address, actor in get_actor_index(rom):
+        actor_id = rom.read_int16(actor_id_address)
+        if actor_ids is None or actor_id in actor_ids:
+            entry = actor_func(rom, actor_id, actor, scene)
+            if entry:
+                actors[actor] = entry
     return actors
 
 
@@ -2378,7 +2420,7 @@ def remove_entrance_blockers(rom):
             actor_var = rom.read_int16(actor + 14);
             if actor_var == 0xFF01:
                 rom.write_int16(actor + 14, 0x0700)
-    get_actor_list(rom, remove_entrance_blockers_do)
+    get_actor_list(rom, remove_entrance_blockers_do, {0x014E})
 
 def set_cow_id_data(rom, world):
     def set_cow_id(rom, actor_id, actor, scene):
@@ -2403,7 +2445,7 @@ def set_cow_id_data(rom, world):
     last_scene = -1
     cow_count = 1
 
-    get_actor_list(rom, set_cow_id)
+    get_actor_list(rom, set_cow_id, {0x01C6})
 
 
 def set_grotto_shuffle_data(rom, world):
@@ -2427,7 +2469,7 @@ def set_grotto_shuffle_data(rom, world):
             rom.write_int16(rom.sym('GROTTO_EXIT_LIST') + 2 * entrance.data['grotto_id'], entrance.replaces.data['index'])
 
     # Override grotto actors data with the new data
-    get_actor_list(rom, override_grotto_data)
+    get_actor_list(rom, override_grotto_data, {0x009B})
 
 
 def set_deku_salesman_data(rom):
@@ -2437,7 +2479,7 @@ def set_deku_salesman_data(rom):
             if actor_var == 6:
                 rom.write_int16(actor + 14, 0x0003)
 
-    get_actor_list(rom, set_deku_salesman)
+    get_actor_list(rom, set_deku_salesman, {0x0195})
 
 
 def set_jabu_stone_actors(rom, jabu_actor_type):
@@ -2447,7 +2489,7 @@ def set_jabu_stone_actors(rom, jabu_actor_type):
             if actor_type == 0x15:
                 rom.write_byte(actor + 15, jabu_actor_type)
 
-    get_actor_list(rom, set_jabu_stone_actor)
+    get_actor_list(rom, set_jabu_stone_actor, {0x008B})
 
 
 def set_spirit_shortcut_actors(rom):
@@ -2455,7 +2497,7 @@ def set_spirit_shortcut_actors(rom):
         if actor_id == 0x018e and scene == 6: # raise initial elevator height
             rom.write_int16(actor + 4, 0x015E)
 
-    get_actor_list(rom, set_spirit_shortcut)
+    get_actor_list(rom, set_spirit_shortcut, {0x018E})
 
 
 
@@ -2481,7 +2523,7 @@ def get_locked_doors(rom, world):
             if actor_id == 0x002E and actor_type == 0x05:
                 return [0x00D4 + scene * 0x1C + 0x04 + flag_byte, flag_bits]
 
-    return get_actor_list(rom, locked_door)
+    return get_actor_list(rom, locked_door, {0x0009, 0x002E})
 
 
 def create_fake_name(name):
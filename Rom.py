@@ -1,7 +1,9 @@
+from bisect import bisect_left, bisect_right
 import io
 import itertools
 import json
 import logging
+import mmap
 import os
 import platform
 import struct
@@ -12,17 +14,211 @@ from Utils import is_bundled, subprocess_args, local_path, data_path, default_ou
 from ntype import BigStream, uint32
 from crc import calculate_crc
 from version import __version__
+from Yaz0 import decompress_rom_data
 
 DMADATA_START = 0x7430
 
+
+# A set of addresses, kept as sorted [start, end) ranges that neither overlap nor touch.
+class RangeSet(object):
+
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.ends = []
+        for start, end in ranges:
+            self.add(start, end)
+
+
+    def __copy__(self):
+        new_set = RangeSet()
+        new_set.starts = list(self.starts)
+        new_set.ends = list(self.ends)
+        return new_set
+
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+
+    def __bool__(self):
+        return bool(self.starts)
+
+
+    def __contains__(self, address):
+        i = bisect_right(self.starts, address) - 1
+        return i >= 0 and address < self.ends[i]
+
+
+    def add(self, start, end):
+        if end <= start:
+            return
+        # Merge with every range that overlaps or touches this one.
+        i = bisect_left(self.ends, start)
+        j = bisect_right(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+
+# Reads the 16-byte records of the DMA table from address, a block at a time.
+def iter_dma_records(buffer, address):
+    while True:
+        block = buffer[address:address + 0x1000]
+        block = block[:len(block) & -0x10]
+        if not block:
+            return
+        yield from struct.iter_unpack('>IIII', block)
+        address += len(block)
+
+
+# The records of the DMA table, as (start, end) up to the empty record that ends it.
+# The bytes they were parsed from are kept, so a Rom only parses them again when they changed.
+class DMATable(object):
+
+    def __init__(self, buffer, address):
+        self.records = []
+        for start, end, _, _ in iter_dma_records(buffer, address):
+            if start == 0 and end == 0:
+                break
+            self.records.append((start, end))
+        self.data = bytearray(buffer[address:address + (len(self.records) + 1) * 0x10])
+        # index of the first record of each start address
+        self.index = {}
+        for dma_index, (start, _) in enumerate(self.records):
+            self.index.setdefault(start, dma_index)
+
+
+    def update(self, dma_index, start, end):
+        old_start = self.records[dma_index][0]
+        self.records[dma_index] = (start, end)
+        struct.pack_into('>IIII', self.data, dma_index * 0x10, start, end, start, 0)
+        if self.index.get(old_start) == dma_index:
+            del self.index[old_start]
+            for next_index in range(dma_index + 1, len(self.records)):
+                if self.records[next_index][0] == old_start:
+                    self.index[old_start] = next_index
+                    break
+        if self.index.get(start, dma_index) >= dma_index:
+            self.index[start] = dma_index
+
+
+# A read-only view of the base ROM file, padded with 0s up to size. The file is
+# memory-mapped, so it is shared by every Rom and process that loads it, and the
+# padding is only made when read.
+class RomImage(object):
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = max(size, len(data))
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return bytes(self[i] for i in range(start, stop, step))
+            data = self.data[start:stop]
+            return data + bytes(max(stop - start, 0) - len(data))
+        if key < 0:
+            key += self.size
+        if key < 0 or key >= self.size:
+            raise IndexError('ROM address out of range')
+        return self.data[key] if key < len(self.data) else 0
+
+
+# The buffer of a Rom. Records which pages have been written since it was copied from
+# the original, so that restoring it only copies those pages back.
+class RomBuffer(bytearray):
+    page_bits = 12
+
+    def __init__(self, original=b''):
+        if isinstance(original, RomImage):
+            super().__init__(original.data)
+            bytearray.extend(self, bytes(len(original) - len(original.data)))
+        else:
+            super().__init__(original)
+        self.original = original
+        # None when the size changed, and everything must be restored.
+        self.dirty_pages = set()
+
+
+    def __copy__(self):
+        new_buffer = RomBuffer(self)
+        new_buffer.original = self.original
+        new_buffer.dirty_pages = None if self.dirty_pages is None else set(self.dirty_pages)
+        return new_buffer
+
+
+    def __setitem__(self, key, value):
+        size = len(self)
+        super().__setitem__(key, value)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(size)
+            if len(self) != size:
+                self.dirty_pages = None
+            else:
+                self.mark_dirty(start, stop)
+        else:
+            self.mark_dirty(key % size, key % size + 1)
+
+
+    def mark_dirty(self, start, end):
+        if self.dirty_pages is not None and end > start:
+            self.dirty_pages.update(range(start >> self.page_bits, ((end - 1) >> self.page_bits) + 1))
+
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.dirty_pages = None
+
+
+    def __iadd__(self, values):
+        self.dirty_pages = None
+        return super().__iadd__(values)
+
+
+    def append(self, value):
+        super().append(value)
+        self.dirty_pages = None
+
+
+    def extend(self, values):
+        super().extend(values)
+        self.dirty_pages = None
+
+
+    def insert(self, index, value):
+        super().insert(index, value)
+        self.dirty_pages = None
+
+
+    def restore(self):
+        if self.dirty_pages is None or len(self) != len(self.original):
+            super().__setitem__(slice(None), self.original[:])
+        else:
+            page_size = 1 << self.page_bits
+            for page in self.dirty_pages:
+                start = page << self.page_bits
+                super().__setitem__(slice(start, start + page_size), self.original[start:start + page_size])
+        self.dirty_pages = set()
+
+
 class Rom(BigStream):
 
     def __init__(self, file=None):
         super().__init__([])
 
         self.original = None
-        self.changed_address = {}
+        self.crc_cache = None
+        self.changed_ranges = RangeSet()
         self.changed_dma = {}
+        self.dma_table = None
         self.force_patch = []
 
         if file is None:
@@ -50,9 +246,10 @@ class Rom(BigStream):
         # decompress rom, or check if it's already decompressed
         self.decompress_rom_file(file, decomp_file)
 
-        # Add file to maximum size
-        self.buffer.extend(bytearray([0x00] * (0x4000000 - len(self.buffer))))
-        self.original = self.copy()
+        # Add file to maximum size. The padding is only made when read.
+        self.original = Rom()
+        self.original.buffer = RomImage(self.buffer, 0x4000000)
+        self.buffer = RomBuffer(self.original.buffer)
 
         # Add version number to header.
         self.write_bytes(0x35, get_version_bytes(__version__)[:3])
@@ -62,7 +259,7 @@ class Rom(BigStream):
     def copy(self):
         new_rom = Rom()
         new_rom.buffer = copy.copy(self.buffer)
-        new_rom.changed_address = copy.copy(self.changed_address)
+        new_rom.changed_ranges = copy.copy(self.changed_ranges)
         new_rom.changed_dma = copy.copy(self.changed_dma)
         new_rom.force_patch = copy.copy(self.force_patch)
         return new_rom
@@ -85,51 +282,93 @@ class Rom(BigStream):
             # ROM is too big, or too small, or not a bad type
             raise RuntimeError('ROM file %s is not a valid OoT 1.0 US ROM.' % file)
         elif len(self.buffer) == 0x2000000:
-            # If Input ROM is compressed, then Decompress it
-            subcall = []
+            # If Input ROM is compressed, then Decompress it. Every valid compressed rom
+            # decompresses to the same rom, so one decompressed before can be reused.
+            if verify_crc and decomp_file and os.path.isfile(decomp_file):
+                compressed_buffer = self.buffer
+                self.read_rom(decomp_file)
+                if list(self.buffer[0x10:0x18]) == validCRC[2] and len(self.buffer) > 0x2000000:
+                    return
+                self.buffer = compressed_buffer
 
             sub_dir = "./" if is_bundled() else "bin/Decompress/"
+            decompressor_path = None
 
             if platform.system() == 'Windows':
                 if 8 * struct.calcsize("P") == 64:
-                    subcall = [sub_dir + "Decompress.exe", file, decomp_file]
+                    decompressor_path = sub_dir + "Decompress.exe"
                 else:
-                    subcall = [sub_dir + "Decompress32.exe", file, decomp_file]
+                    decompressor_path = sub_dir + "Decompress32.exe"
             elif platform.system() == 'Linux':
                 if platform.machine() in ['arm64', 'aarch64', 'aarch64_be', 'armv8b', 'armv8l']:
-                    subcall = [sub_dir + "Decompress_ARM64", file, decomp_file]
+                    decompressor_path = sub_dir + "Decompress_ARM64"
                 elif platform.machine() in ['arm', 'armv7l', 'armhf']:
-                    subcall = [sub_dir + "Decompress_ARM32", file, decomp_file]
+                    decompressor_path = sub_dir + "Decompress_ARM32"
                 else:
-                    subcall = [sub_dir + "Decompress", file, decomp_file]
+                    decompressor_path = sub_dir + "Decompress"
             elif platform.system() == 'Darwin':
                 if platform.machine() == 'arm64':
-                    subcall = [sub_dir + "Decompress_ARM64.out", file, decomp_file]
+                    decompressor_path = sub_dir + "Decompress_ARM64.out"
                 else:
-                    subcall = [sub_dir + "Decompress.out", file, decomp_file]
-            else:
-                raise RuntimeError('Unsupported operating system for decompression. Please supply an already decompressed ROM.')
+                    decompressor_path = sub_dir + "Decompress.out"
 
-            subprocess.call(subcall, **subprocess_args())
+            # Write to a temporary file first, as the decompressed rom might
+            # still be mapped by another Rom, which truncating it would break.
+            decomp_tmp_file = '%s.%d.tmp' % (decomp_file, os.getpid())
+            if decompressor_path is not None and os.path.isfile(decompressor_path):
+                subprocess.call([decompressor_path, file, decomp_tmp_file], **subprocess_args())
+            else:
+                # Without a decompressor binary for this system, fall back to the slower Python one.
+                logging.getLogger('').info('No ROM decompressor found for this system, decompressing in Python.')
+                with open(decomp_tmp_file, 'wb') as outfile:
+                    outfile.write(decompress_rom_data(self.buffer))
+            try:
+                os.replace(decomp_tmp_file, decomp_file)
+            except OSError:
+                # Without a temporary file the decompressor failed, which is the error to report.
+                if not os.path.isfile(decomp_tmp_file):
+                    raise
+                # Windows can't replace a mapped file, but it is the same decompressed rom.
+                os.remove(decomp_tmp_file)
             self.read_rom(decomp_file)
         else:
             # ROM file is a valid and already uncompressed
             pass
 
 
+    # These write to the buffer directly, which is faster than through RomBuffer.__setitem__.
     def write_byte(self, address, value):
-        super().write_byte(address, value)
-        self.changed_address[self.last_address-1] = value
+        if address == None:
+            address = self.last_address
+        buffer = self.buffer
+        bytearray.__setitem__(buffer, address, value)
+        if type(buffer) is RomBuffer and buffer.dirty_pages is not None:
+            buffer.dirty_pages.add(address >> RomBuffer.page_bits)
+        self.last_address = address + 1
+        self.changed_ranges.add(address, address + 1)
 
 
     def write_bytes(self, address, values):
-        super().write_bytes(address, values)
-        self.changed_address.update(zip(range(address, address+len(values)), values))
+        if address == None:
+            address = self.last_address
+        buffer = self.buffer
+        end = address + len(values)
+        bytearray.__setitem__(buffer, slice(address, end), values)
+        if type(buffer) is RomBuffer and buffer.dirty_pages is not None:
+            if address >> RomBuffer.page_bits == (end - 1) >> RomBuffer.page_bits:
+                buffer.dirty_pages.add(address >> RomBuffer.page_bits)
+            else:
+                buffer.mark_dirty(address, end)
+        self.last_address = end
+        self.changed_ranges.add(address, end)
 
 
     def restore(self):
-        self.buffer = copy.copy(self.original.buffer)
-        self.changed_address = {}
+        if isinstance(self.buffer, RomBuffer) and self.buffer.original is self.original.buffer:
+            self.buffer.restore()
+        else:
+            self.buffer = RomBuffer(self.original.buffer)
+        self.changed_ranges = RangeSet()
         self.changed_dma = {}
         self.force_patch = []
         self.last_address = None
@@ -148,18 +387,25 @@ class Rom(BigStream):
             outfile.write(self.buffer)
 
 
+    # The CRC only covers 0x1000-0x101000, and 0x750-0x850 for its key,
+    # so it is only recalculated if those changed since the last time.
     def update_header(self):
-        crc = calculate_crc(self)
-        self.write_bytes(0x10, crc)
+        crc_data = (self.read_bytes(0x1000, 0x100000), self.read_bytes(0x750, 0x100))
+        if self.crc_cache is None or self.crc_cache[0] != crc_data:
+            self.crc_cache = (crc_data, calculate_crc(self))
+        self.write_bytes(0x10, self.crc_cache[1])
 
 
     def read_rom(self, file):
-        # "Reads rom into bytearray"
+        # "Maps rom into memory, read-only"
         try:
             with open(file, 'rb') as stream:
-                self.buffer = bytearray(stream.read())
+                self.buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
         except FileNotFoundError as ex:
             raise FileNotFoundError('Invalid path to Base ROM: "' + file + '"')
+        except ValueError:
+            # empty files can't be mapped
+            raise RuntimeError('ROM file %s is not a valid OoT 1.0 US ROM.' % file)
 
 
     # dmadata/file management helper functions
@@ -171,42 +417,35 @@ class Rom(BigStream):
         return start, end, size
 
 
+    # The DMA table is parsed again only if its bytes changed since the last time.
+    def get_dma_table(self):
+        table = self.dma_table
+        if table is None or self.buffer[DMADATA_START:DMADATA_START + len(table.data)] != table.data:
+            table = self.dma_table = DMATable(self.buffer, DMADATA_START)
+        return table
+
+
     def get_dmadata_record_by_key(self, key):
-        cur = DMADATA_START
-        dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
-        while True:
-            if dma_start == 0 and dma_end == 0:
-                return None
-            if dma_start == key:
-                return dma_start, dma_end, dma_size
-            cur += 0x10
-            dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
+        table = self.get_dma_table()
+        dma_index = table.index.get(key)
+        if dma_index is None:
+            return None
+        dma_start, dma_end = table.records[dma_index]
+        return dma_start, dma_end, dma_end - dma_start
 
 
     def verify_dmadata(self):
-        cur = DMADATA_START
         overlapping_records = []
-        dma_data = []
-
-        while True:
-            this_start, this_end, this_size = self._get_dmadata_record(cur)
-
-            if this_start == 0 and this_end == 0:
-                break
-
-            dma_data.append((this_start, this_end, this_size))
-            cur += 0x10
-
-        dma_data.sort(key=lambda v: v[0])
+        dma_data = sorted(self.get_dma_table().records, key=lambda v: v[0])
 
         for i in range(0, len(dma_data) - 1):
-            this_start, this_end, this_size = dma_data[i]
-            next_start, next_end, next_size = dma_data[i + 1]
+            this_start, this_end = dma_data[i]
+            next_start, next_end = dma_data[i + 1]
 
             if this_end > next_start:
                 overlapping_records.append(
                         '0x%08X - 0x%08X (Size: 0x%04X)\n0x%08X - 0x%08X (Size: 0x%04X)' % \
-                         (this_start, this_end, this_size, next_start, next_end, next_size)
+                         (this_start, this_end, this_end - this_start, next_start, next_end, next_end - next_start)
                     )
 
         if len(overlapping_records) > 0:
@@ -218,20 +457,16 @@ class Rom(BigStream):
     # if key is not found, then attempt to add a new dmadata entry
     def update_dmadata_record(self, key, start, end, from_file=None):
         cur, dma_data_end = self.get_dma_table_range()
-        dma_index = 0
-        dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
-        while dma_start != key:
-            if dma_start == 0 and dma_end == 0:
-                break
-
-            cur += 0x10
-            dma_index += 1
-            dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
+        table = self.get_dma_table()
+        dma_index = table.index.get(key, len(table.records))
+        cur += dma_index * 0x10
 
         if cur >= (dma_data_end - 0x10):
             raise Exception('dmadata update failed: key {0:x} not found in dmadata and dma table is full.'.format(key))
         else:
             self.write_int32s(cur, [start, end, start, 0])
+            if dma_index < len(table.records) and not (start == 0 and end == 0):
+                table.update(dma_index, start, end)
             if from_file == None:
                 if key == None:
                     from_file = -1
@@ -241,30 +476,26 @@ class Rom(BigStream):
 
 
     def get_dma_table_range(self):
-        cur = DMADATA_START
-        dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
-        while True:
-            if dma_start == 0 and dma_end == 0:
-                raise Exception('Bad DMA Table: DMA Table entry missing.')
-
-            if dma_start == DMADATA_START:
-                return (DMADATA_START, dma_end)
-
-            cur += 0x10
-            dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
+        table = self.get_dma_table()
+        if DMADATA_START not in table.index:
+            raise Exception('Bad DMA Table: DMA Table entry missing.')
+        return table.records[table.index[DMADATA_START]]
 
 
     # This will scan for any changes that have been made to the DMA table
     # By default, this assumes any changes here are new files, so this should only be called
     # after patching in the new files, but before vanilla files are repointed
     def scan_dmadata_update(self, preserve_from_file=False, assume_move=False):
-        cur = DMADATA_START
-        dma_data_end = None
+        records = self.get_dma_table().records
+        old_records = self.original.get_dma_table().records
         dma_index = 0
-        dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
-        old_dma_start, old_dma_end, old_dma_size = self.original._get_dmadata_record(cur)
 
         while True:
+            # Past the end of a table, its records are read as they are.
+            cur = DMADATA_START + dma_index * 0x10
+            dma_start, dma_end = records[dma_index] if dma_index < len(records) else self._get_dmadata_record(cur)[:2]
+            old_dma_start, old_dma_end = old_records[dma_index] if dma_index < len(old_records) else self.original._get_dmadata_record(cur)[:2]
+
             if (dma_start == 0 and dma_end == 0) and \
             (old_dma_start == 0 and old_dma_end == 0):
                 break
@@ -278,40 +509,32 @@ class Rom(BigStream):
                     from_file = old_dma_start
                 self.changed_dma[dma_index] = (from_file, dma_start, dma_end - dma_start)
 
-            cur += 0x10
             dma_index += 1
-            dma_start, dma_end, dma_size = self._get_dmadata_record(cur)
-            old_dma_start, old_dma_end, old_dma_size = self.original._get_dmadata_record(cur)
 
 
-    # This will rescan the entire ROM, compare to original ROM, and repopulate changed_address.
+    # This will rescan the entire ROM, compare to original ROM, and repopulate changed_ranges.
     def rescan_changed_bytes(self):
-        self.changed_address = {}
+        self.changed_ranges = RangeSet()
         size = len(self.buffer)
         original_size = len(self.original.buffer)
-        for i, byte in enumerate(self.buffer):
-            if i >= original_size:
-                self.changed_address[i] = byte
+        common_size = min(size, original_size)
+        page_size = 1 << RomBuffer.page_bits
+        # Compare whole pages first, and bytes only in those that differ.
+        for page_start in range(0, common_size, page_size):
+            page_end = min(page_start + page_size, common_size)
+            if self.buffer[page_start:page_end] == self.original.buffer[page_start:page_end]:
                 continue
-            orig_byte = self.original.read_byte(i)
-            if byte != orig_byte:
-                self.changed_address[i] = byte
+            for i in range(page_start, page_end):
+                if self.buffer[i] != self.original.buffer[i]:
+                    self.changed_ranges.add(i, i + 1)
+        if size > original_size:
+            self.changed_ranges.add(original_size, size)
         if size < original_size:
-            self.changed_address.update(zip(range(size, original_size-1), [0]*(original_size-size)))
+            self.changed_ranges.add(size, original_size - 1)
 
 
     # gets the last used byte of rom defined in the DMA table
     def free_space(self):
-        cur = DMADATA_START
-        max_end = 0
-
-        while True:
-            this_start, this_end, this_size = self._get_dmadata_record(cur)
-
-            if this_start == 0 and this_end == 0:
-                break
-
-            max_end = max(max_end, this_end)
-            cur += 0x10
+        max_end = max((end for _, end in self.get_dma_table().records), default=0)
         max_end = ((max_end + 0x0F) >> 4) << 4
         return max_end
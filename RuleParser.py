@@ -1,14 +1,23 @@
 import ast
 from collections import defaultdict
+import contextlib
+import copy
+import hashlib
+from importlib.util import MAGIC_NUMBER
 from inspect import signature, _ParameterKind
 import logging
+import marshal
+import os
+import pickle
 import re
+import tempfile
 
 from Item import ItemInfo, MakeEventItem
 from Location import Location
 from Region import TimeOfDay
 from State import State
 from Utils import data_path, read_logic_file
+from version import __version__
 
 
 escaped_items = {}
@@ -28,9 +37,33 @@ kwarg_defaults = {
 
 allowed_globals = {'TimeOfDay': TimeOfDay}
 
+# State functions that take item names as their first argument.
+item_lookup_functions = {'has', 'has_any_of', 'has_all_of', 'count_of', 'item_count'}
+# Item names read by other State functions that can appear in compiled rules.
+# State functions not listed here are assumed to read any item.
+state_function_items = {
+    'has_bottle': ItemInfo.bottles | {'Rutos Letter'},
+    'has_hearts': {'Piece of Heart'},
+    'heart_count': {'Piece of Heart'},
+    'has_medallions': ItemInfo.medallions,
+    'has_stones': ItemInfo.stones,
+    'has_dungeon_rewards': ItemInfo.medallions | ItemInfo.stones,
+    'had_night_start': set(),
+    'can_live_dmg': set(),
+    'region_has_shortcuts': set(),
+}
+
 rule_aliases = {}
 nonaliases = set()
 
+# How many sets of world values to keep compiled rules for, per logic file.
+logic_cache_variants = 8
+
+# Compiled rules by their ast dump, and the compiled rules of the logic files
+# and delayed rules, shared by all worlds in the process.
+compiled_rules = {}
+compiled_logic = {}
+
 def load_aliases():
     j = read_logic_file(data_path('LogicHelpers.json'))
     for s, repl in j.items():
@@ -44,6 +77,50 @@ def load_aliases():
     nonaliases = escaped_items.keys() - rule_aliases.keys()
 
 
+# Adds a compiled rule to the rules shared by all worlds, unless it is already there.
+def make_compiled_rule(rule_str, code, dependencies, reads_search):
+    if rule_str not in compiled_rules:
+        # globals/locals. if undefined, everything in the namespace *now* would be allowed
+        rule = eval(code, allowed_globals)
+        rule.rule_str = rule_str
+        rule.code = code
+        rule.dependencies = dependencies
+        rule.reads_search = reads_search
+        compiled_rules[rule_str] = rule
+    return compiled_rules[rule_str]
+
+
+# Value recorded for names that were looked up but not found.
+class MissingName(object):
+    pass
+
+
+# Name lookups into the world or settings, as the rules of a logic file
+# compile differently depending on those values.
+# Records every lookup while a logic file is being compiled for the cache.
+class RecordedNamespace(object):
+
+    def __init__(self, transformer, kind, namespace):
+        self.transformer = transformer
+        self.kind = kind
+        self.namespace = namespace
+
+
+    def __contains__(self, name):
+        self.record(name)
+        return name in self.namespace
+
+
+    def __getitem__(self, name):
+        self.record(name)
+        return self.namespace[name]
+
+
+    def record(self, name):
+        if self.transformer.recorded_logic is not None:
+            self.transformer.recorded_logic['reads'][(self.kind, name)] = self.namespace.get(name, MissingName)
+
+
 def isliteral(expr):
     return isinstance(expr, (ast.Num, ast.Str, ast.Bytes, ast.NameConstant))
 
@@ -62,6 +139,21 @@ class Rule_AST_Transformer(ast.NodeTransformer):
             load_aliases()
         # final rule cache
         self.rule_cache = {}
+        # logic cache entry being replayed or recorded for the current logic file
+        self.logic_cache_path = None
+        self.logic_cache = None
+        self.cached_logic = None
+        self.recorded_logic = None
+
+
+    @property
+    def world_names(self):
+        return RecordedNamespace(self, 'world', self.world.__dict__)
+
+
+    @property
+    def setting_names(self):
+        return RecordedNamespace(self, 'settings', self.world.settings.__dict__)
 
 
     def visit_Name(self, node):
@@ -81,11 +173,11 @@ class Rule_AST_Transformer(ast.NodeTransformer):
                     ctx=ast.Load()),
                 args=[ast.Str(escaped_items[node.id])],
                 keywords=[])
-        elif node.id in self.world.__dict__:
-            return ast.parse('%r' % self.world.__dict__[node.id], mode='eval').body
-        elif node.id in self.world.settings.__dict__:
+        elif node.id in self.world_names:
+            return ast.parse('%r' % self.world_names[node.id], mode='eval').body
+        elif node.id in self.setting_names:
             # Settings are constant
-            return ast.parse('%r' % self.world.settings.__dict__[node.id], mode='eval').body
+            return ast.parse('%r' % self.setting_names[node.id], mode='eval').body
         elif node.id in State.__dict__:
             return self.make_call(node, node.id, [], [])
         elif node.id in kwarg_defaults or node.id in allowed_globals:
@@ -134,7 +226,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
 
         if isinstance(count, ast.Name):
             # Must be a settings constant
-            count = ast.parse('%r' % self.world.settings.__dict__[count.id], mode='eval').body
+            count = ast.parse('%r' % self.setting_names[count.id], mode='eval').body
 
         if iname in escaped_items:
             iname = escaped_items[iname]
@@ -179,7 +271,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
         new_args = []
         for child in node.args:
             if isinstance(child, ast.Name):
-                if child.id in self.world.__dict__:
+                if child.id in self.world_names:
                     child = ast.Attribute(
                         value=ast.Attribute(
                             value=ast.Name(id='state', ctx=ast.Load()),
@@ -187,7 +279,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
                             ctx=ast.Load()),
                         attr=child.id,
                         ctx=ast.Load())
-                elif child.id in self.world.settings.__dict__:
+                elif child.id in self.setting_names:
                     child = ast.Attribute(
                         value=ast.Attribute(
                             value=ast.Attribute(
@@ -239,8 +331,8 @@ class Rule_AST_Transformer(ast.NodeTransformer):
         # Fast check for json can_use
         if (len(node.ops) == 1 and isinstance(node.ops[0], ast.Eq)
                 and isinstance(node.left, ast.Name) and isinstance(node.comparators[0], ast.Name)
-                and node.left.id not in self.world.__dict__ and node.comparators[0].id not in self.world.__dict__
-                and node.left.id not in self.world.settings.__dict__ and node.comparators[0].id not in self.world.settings.__dict__):
+                and node.left.id not in self.world_names and node.comparators[0].id not in self.world_names
+                and node.left.id not in self.setting_names and node.comparators[0].id not in self.setting_names):
             return ast.NameConstant(node.left.id == node.comparators[0].id)
 
         node.left = escape_or_string(node.left)
@@ -356,6 +448,8 @@ class Rule_AST_Transformer(ast.NodeTransformer):
         subrule_name = target + ' Subrule %d' % (1 + len(self.replaced_rules[target]))
         # Save the info to be made into a rule later
         self.delayed_rules.append((target, node, subrule_name))
+        if self.recorded_logic is not None:
+            self.recorded_logic['subrules'].append((target, node))
         # Replace the call with a reference to that item
         item_rule = ast.Call(
             func=ast.Attribute(
@@ -372,6 +466,13 @@ class Rule_AST_Transformer(ast.NodeTransformer):
 
     # Requires the target regions have been defined in the world.
     def create_delayed_rules(self):
+        # The delayed rules compile the same for worlds that made the same subrules.
+        key = hashlib.sha256()
+        for target, rules in self.replaced_rules.items():
+            for rule, item_rule in rules.items():
+                key.update(('%s\0%s\0%s\n' % (target, item_rule.args[0].s, rule)).encode())
+        self.open_logic_cache('delayed', key, lambda: None)
+
         for region_name, node, subrule_name in self.delayed_rules:
             region = self.world.get_region(region_name)
             event = Location(subrule_name, type='Event', parent=region, internal=True)
@@ -379,7 +480,8 @@ class Rule_AST_Transformer(ast.NodeTransformer):
 
             self.current_spot = event
             # This could, in theory, create further subrules.
-            access_rule = self.make_access_rule(self.visit(node))
+            # The node is copied as it may be shared with other worlds through the cache.
+            access_rule = self.cached_spot_rule(event, lambda: self.make_access_rule(self.visit(copy.deepcopy(node))))
             if access_rule is self.rule_cache.get('NameConstant(False)') or access_rule is self.rule_cache.get('Constant(False)'):
                 event.access_rule = None
                 event.never = True
@@ -391,35 +493,206 @@ class Rule_AST_Transformer(ast.NodeTransformer):
                 region.locations.append(event)
 
                 MakeEventItem(subrule_name, event)
+        self.save_logic_file()
         # Safeguard in case this is called multiple times per world
         self.delayed_rules.clear()
 
 
+    # Returns the frozenset of item names the compiled rule body reads from the state,
+    # or None if that can't be determined statically.
+    def rule_dependencies(self, body):
+        dependencies = set()
+        for node in ast.walk(body):
+            if not isinstance(node, ast.Call):
+                continue
+            if not (isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name) and node.func.value.id == 'state'):
+                # state.search.can_reach only reads the search cache
+                if not self.is_search_call(node):
+                    return None
+            elif node.func.attr in item_lookup_functions:
+                items = node.args[0]
+                if isinstance(items, (ast.Tuple, ast.List)):
+                    items = items.elts
+                else:
+                    items = [items]
+                for item in items:
+                    if not isinstance(item, ast.Constant) or not isinstance(item.value, str):
+                        return None
+                    dependencies.add(item.value)
+            elif node.func.attr in state_function_items:
+                dependencies.update(state_function_items[node.func.attr])
+            else:
+                return None
+        return frozenset(dependencies)
+
+
+    # Whether the call is to state.search, whose result can change as regions are reached.
+    def is_search_call(self, node):
+        return (isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Attribute)
+                and node.func.value.attr == 'search')
+
+
+    # Whether the rule's result depends on more than the items it reads.
+    def rule_reads_search(self, body):
+        return any(isinstance(node, ast.Call) and self.is_search_call(node) for node in ast.walk(body))
+
+
     def make_access_rule(self, body):
         rule_str = ast.dump(body, False)
         if rule_str not in self.rule_cache:
-            # requires consistent iteration on dicts
-            kwargs = [ast.arg(arg=k) for k in kwarg_defaults.keys()]
-            kwd = list(map(ast.Constant, kwarg_defaults.values()))
-            try:
-                self.rule_cache[rule_str] = eval(compile(
-                    ast.fix_missing_locations(
-                        ast.Expression(ast.Lambda(
-                            args=ast.arguments(
-                                posonlyargs=[],
-                                args=[ast.arg(arg='state')],
-                                defaults=[],
-                                kwonlyargs=kwargs,
-                                kw_defaults=kwd),
-                            body=body))),
-                    '<string>', 'eval'),
-                    # globals/locals. if undefined, everything in the namespace *now* would be allowed
-                    allowed_globals)
-            except TypeError as e:
-                raise Exception('Parse Error: %s' % e, self.current_spot.name, ast.dump(body, False))
+            if rule_str not in compiled_rules:
+                # requires consistent iteration on dicts
+                kwargs = [ast.arg(arg=k) for k in kwarg_defaults.keys()]
+                kwd = list(map(ast.Constant, kwarg_defaults.values()))
+                try:
+                    code = compile(
+                        ast.fix_missing_locations(
+                            ast.Expression(ast.Lambda(
+                                args=ast.arguments(
+                                    posonlyargs=[],
+                                    args=[ast.arg(arg='state')],
+                                    defaults=[],
+                                    kwonlyargs=kwargs,
+                                    kw_defaults=kwd),
+                                body=body))),
+                        '<string>', 'eval')
+                except TypeError as e:
+                    raise Exception('Parse Error: %s' % e, self.current_spot.name, ast.dump(body, False))
+                make_compiled_rule(rule_str, code, self.rule_dependencies(body), self.rule_reads_search(body))
+            self.rule_cache[rule_str] = compiled_rules[rule_str]
         return self.rule_cache[rule_str]
 
 
+    ## Logic cache
+    # The compiled rules of each logic file are kept for the rest of the process, along with
+    # every world and settings value that was looked up to compile them, and saved to disk
+    # too if settings.logic_cache_dir is set. Worlds that look up the same values reuse those
+    # rules, and the same rule functions, without parsing them again.
+
+    # Reads a logic file for World.load_regions_from_json and prepares its cache entry.
+    def load_logic_file(self, file_path):
+        # Without logic, no rules are parsed at all.
+        if self.world.settings.logic_rules == 'none':
+            self.close_logic_cache()
+            return read_logic_file(file_path)
+
+        key = hashlib.sha256()
+        for path in (file_path, data_path('LogicHelpers.json')):
+            with open(path, 'rb') as f:
+                key.update(f.read())
+        self.open_logic_cache(os.path.splitext(os.path.basename(file_path))[0], key, lambda: read_logic_file(file_path))
+        return self.logic_cache['regions']
+
+
+    # Saves the rules compiled since load_logic_file to the logic cache, if there are any.
+    def save_logic_file(self):
+        if self.recorded_logic is not None:
+            self.recorded_logic['events'] = self.events - self.recorded_logic['events']
+            self.logic_cache['variants'] = self.logic_cache['variants'][-(logic_cache_variants - 1):] + [self.recorded_logic]
+            if self.logic_cache_path is not None:
+                self.write_logic_cache()
+        self.close_logic_cache()
+
+
+    # Finds the cache entry for the given name and key, from memory, from disk,
+    # or as a new entry with the regions given by read_regions.
+    # Then either replays the variant that matches this world, or starts recording a new one.
+    def open_logic_cache(self, name, key, read_regions):
+        key.update(__version__.encode())
+        key.update(MAGIC_NUMBER)
+        cache_name = '%s-%s' % (name, key.hexdigest()[:16])
+        cache_dir = self.world.settings.logic_cache_dir
+        self.logic_cache_path = os.path.join(cache_dir, cache_name + '.pickle') if cache_dir else None
+        self.logic_cache = compiled_logic.get(cache_name)
+        self.cached_logic = None
+        self.recorded_logic = None
+        if self.logic_cache is None and self.logic_cache_path is not None:
+            self.read_logic_cache()
+        if self.logic_cache is None:
+            self.logic_cache = {'regions': read_regions(), 'variants': []}
+        compiled_logic[cache_name] = self.logic_cache
+
+        # Subrules are numbered per region across files, so the files before must have made the same ones.
+        subrule_counts = {target: len(rules) for target, rules in self.replaced_rules.items()}
+        for variant in self.logic_cache['variants']:
+            if variant['subrule_counts'] == subrule_counts and all(
+                    self.world_value(kind, name) == value for (kind, name), value in variant['reads'].items()):
+                self.cached_logic = variant
+                for target, node in variant['subrules']:
+                    self.replace_subrule(target, node)
+                self.events.update(variant['events'])
+                return
+        self.recorded_logic = {
+            'reads': {},
+            'subrule_counts': subrule_counts,
+            'subrules': [],
+            'events': set(self.events),
+            'rules': {},
+        }
+
+
+    def close_logic_cache(self):
+        self.logic_cache_path = None
+        self.logic_cache = None
+        self.cached_logic = None
+        self.recorded_logic = None
+
+
+    # Rules are saved as their code, and made into functions again once when read.
+    def read_logic_cache(self):
+        try:
+            with open(self.logic_cache_path, 'rb') as f:
+                self.logic_cache = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.logic_cache = None
+            return
+        for variant in self.logic_cache['variants']:
+            for spot, (rule_str, code, dependencies, reads_search) in variant['rules'].items():
+                if rule_str not in compiled_rules:
+                    make_compiled_rule(rule_str, marshal.loads(code), dependencies, reads_search)
+                variant['rules'][spot] = compiled_rules[rule_str]
+
+
+    def write_logic_cache(self):
+        logic_cache = dict(self.logic_cache, variants=[
+            dict(variant, rules={
+                spot: (rule.rule_str, marshal.dumps(rule.code), rule.dependencies, rule.reads_search)
+                for spot, rule in variant['rules'].items()})
+            for variant in self.logic_cache['variants']])
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(self.logic_cache_path), exist_ok=True)
+            # Write to a temporary file first, so other processes never read a partial cache.
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.logic_cache_path))
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(logic_cache, f)
+            os.replace(temp_path, self.logic_cache_path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            logging.getLogger('').warning('Could not write logic cache %s: %s', self.logic_cache_path, e)
+        finally:
+            # A failed write must not leave its temporary file behind.
+            if temp_path is not None and os.path.exists(temp_path):
+                with contextlib.suppress(OSError):
+                    os.remove(temp_path)
+
+
+    # Returns the cached rule of the spot, or the one compile_rule makes, recording it for the cache.
+    def cached_spot_rule(self, spot, compile_rule):
+        if self.cached_logic is not None:
+            rule = self.cached_logic['rules'][(spot.parent_region.name, spot.name)]
+            return self.rule_cache.setdefault(rule.rule_str, rule)
+        access_rule = compile_rule()
+        if self.recorded_logic is not None:
+            self.recorded_logic['rules'][(spot.parent_region.name, spot.name)] = access_rule
+        return access_rule
+
+
+    # Returns the current value of a name recorded by RecordedNamespace.
+    def world_value(self, kind, name):
+        namespace = self.world.__dict__ if kind == 'world' else self.world.settings.__dict__
+        return namespace.get(name, MissingName)
+
+
     ## Handlers for specific internal functions used in the json logic.
 
     # at(region_name, rule)
@@ -443,24 +716,24 @@ class Rule_AST_Transformer(ast.NodeTransformer):
     ## Handlers for compile-time optimizations (former State functions)
 
     def at_day(self, node):
-        if self.world.ensure_tod_access:
+        if self.world_names['ensure_tod_access']:
             # tod has DAY or (tod == NONE and (ss or find a path from a provider))
             # parsing is better than constructing this expression by hand
             return ast.parse("(tod & TimeOfDay.DAY) if tod else (state.has_all_of(('Ocarina', 'Suns Song')) or state.search.can_reach(spot.parent_region, age=age, tod=TimeOfDay.DAY))", mode='eval').body
         return ast.NameConstant(True)
 
     def at_dampe_time(self, node):
-        if self.world.ensure_tod_access:
+        if self.world_names['ensure_tod_access']:
             # tod has DAMPE or (tod == NONE and (find a path from a provider))
             # parsing is better than constructing this expression by hand
             return ast.parse("(tod & TimeOfDay.DAMPE) if tod else state.search.can_reach(spot.parent_region, age=age, tod=TimeOfDay.DAMPE)", mode='eval').body
         return ast.NameConstant(True)
 
     def at_night(self, node):
-        if self.current_spot.type == 'GS Token' and self.world.settings.logic_no_night_tokens_without_suns_song:
+        if self.current_spot.type == 'GS Token' and self.setting_names['logic_no_night_tokens_without_suns_song']:
             # Using visit here to resolve 'can_play' rule
             return self.visit(ast.parse('can_play(Suns_Song)', mode='eval').body)
-        if self.world.ensure_tod_access:
+        if self.world_names['ensure_tod_access']:
             # tod has DAMPE or (tod == NONE and (ss or find a path from a provider))
             # parsing is better than constructing this expression by hand
             return ast.parse("(tod & TimeOfDay.DAMPE) if tod else (state.has_all_of(('Ocarina', 'Suns Song')) or state.search.can_reach(spot.parent_region, age=age, tod=TimeOfDay.DAMPE))", mode='eval').body
@@ -476,7 +749,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
     def parse_spot_rule(self, spot):
         rule = spot.rule_string.split('#', 1)[0].strip()
 
-        access_rule = self.parse_rule(rule, spot)
+        access_rule = self.cached_spot_rule(spot, lambda: self.parse_rule(rule, spot))
         spot.set_rule(access_rule)
         if access_rule is self.rule_cache.get('NameConstant(False)') or access_rule is self.rule_cache.get('Constant(False)'):
             spot.never = True
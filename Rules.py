@@ -2,7 +2,6 @@ import logging
 from ItemPool import song_list
 from Location import DisableType
 from Search import Search
-from State import State
 
 
 def set_rules(world):
@@ -120,6 +119,7 @@ def set_shop_rules(world):
     wallet = world.parser.parse_rule('Progressive_Wallet')
     wallet2 = world.parser.parse_rule('(Progressive_Wallet, 2)')
     is_adult = world.parser.parse_rule('is_adult')
+    has_bottle = world.parser.parse_rule('has_bottle')
     for location in world.get_filled_locations():
         if location.item.type == 'Shop':
             # Add wallet requirements
@@ -143,7 +143,7 @@ def set_shop_rules(world):
                                       'Buy Red Potion for 40 Rupees',
                                       'Buy Red Potion for 50 Rupees',
                                       'Buy Fairy\'s Spirit']:
-                location.add_rule(State.has_bottle)
+                location.add_rule(has_bottle)
             if location.item.name in ['Buy Bombchu (10)', 'Buy Bombchu (20)', 'Buy Bombchu (5)']:
                 location.add_rule(found_bombchus)
 
@@ -7,6 +7,10 @@ from State import State
 
 class Search(object):
 
+    # Per-world sets of item names read by rules that passed in the current sphere.
+    # Only tracked by DecrementalSearch.
+    _sphere_dependencies = None
+
     def __init__(self, state_list, initial_cache=None):
         self.state_list = [state.copy() for state in state_list]
 
@@ -92,6 +96,17 @@ class Search(object):
         raise Exception('Unimplemented for Search. Perhaps you want RewindableSearch.')
 
 
+    # Records that the rule of the given spot passed in the current sphere.
+    def _record_dependencies(self, spot):
+        self._sphere_changed = True
+        world_dependencies = self._sphere_dependencies[spot.world.id]
+        if world_dependencies is not None:
+            if spot.dependencies is None:
+                self._sphere_dependencies[spot.world.id] = None
+            else:
+                world_dependencies.update(spot.dependencies)
+
+
     # Internal to the iteration. Modifies the exit_queue, regions. 
     # Returns a queue of the exits whose access rule failed, 
     # as a cache for the exits to try on the next iteration.
@@ -101,6 +116,8 @@ class Search(object):
             if exit.connected_region and exit.connected_region not in regions:
                 # Evaluate the access rule directly, without tod
                 if exit.access_rule(self.state_list[exit.world.id], spot=exit, age=age):
+                    if self._sphere_dependencies is not None:
+                        self._record_dependencies(exit)
                     # If it found a new tod, make sure we try other entrances again.
                     # Probably would take too long and not be worth it if we only grabbed the exits
                     # for the given world...
@@ -125,6 +142,8 @@ class Search(object):
             if exit.connected_region in regions and tod & ~regions[exit.connected_region]:
                 # Evaluate the access rule directly
                 if exit.access_rule(self.state_list[exit.world.id], spot=exit, age=age, tod=tod):
+                    if self._sphere_dependencies is not None:
+                        self._record_dependencies(exit)
                     regions[exit.connected_region] |= tod
                     if exit.connected_region == goal_region:
                         return True
@@ -175,6 +194,8 @@ class Search(object):
                 if (loc.parent_region in adult_regions
                         and loc.access_rule(self.state_list[loc.world.id], spot=loc, age='adult')):
                     had_reachable_locations = True
+                    if self._sphere_dependencies is not None:
+                        self._record_dependencies(loc)
                     # Mark it visited for this algorithm
                     visited_locations.add(loc)
                     yield loc
@@ -182,6 +203,8 @@ class Search(object):
                 elif (loc.parent_region in child_regions
                       and loc.access_rule(self.state_list[loc.world.id], spot=loc, age='child')):
                     had_reachable_locations = True
+                    if self._sphere_dependencies is not None:
+                        self._record_dependencies(loc)
                     # Mark it visited for this algorithm
                     visited_locations.add(loc)
                     yield loc
@@ -373,3 +396,76 @@ class RewindableSearch(Search):
             k: copy.copy(v) for k, v in self._cache.items()
         })
         self._cache = self.cached_spheres[-1]
+
+
+# A search that supports removing items without rebuilding from sphere 0.
+# Before each sphere, it saves a copy of the cache, and while the sphere runs
+# it records which items were read by the rules that passed (see
+# Rule_AST_Transformer.rule_dependencies) and which items were collected.
+# Uncollecting an item rewinds to the start of the first sphere that read it:
+# everything found before that is still reachable without the item, so the
+# next collect_locations reaches the same fixpoint as a fresh search would.
+class DecrementalSearch(Search):
+
+    def __init__(self, state_list, initial_cache=None):
+        # list of [cache copy, collected items, dependencies] per sphere
+        self._sphere_log = []
+        self._sphere_changed = False
+        super().__init__(state_list, initial_cache=initial_cache)
+        if initial_cache:
+            self._start_sphere()
+
+
+    @classmethod
+    def from_search(cls, search):
+        return cls(search.state_list, initial_cache={k: copy.copy(v) for k, v in search._cache.items()})
+
+
+    def _start_sphere(self):
+        # Nothing was reached since the last snapshot, so it still describes the cache.
+        if self._sphere_log and not self._sphere_changed:
+            return
+        self._sphere_changed = False
+        self._sphere_dependencies = [set() for _ in self.state_list]
+        self._sphere_log.append((
+            {k: copy.copy(v) for k, v in self._cache.items()},
+            [],
+            self._sphere_dependencies,
+        ))
+
+
+    def next_sphere(self):
+        self._start_sphere()
+        return super().next_sphere()
+
+
+    def collect_locations(self, item_locations=None):
+        item_locations = item_locations or self.progression_locations()
+        for location in self.iter_reachable_locations(item_locations):
+            self.collect(location.item)
+            self._sphere_log[-1][1].append(location.item)
+            self._sphere_changed = True
+
+
+    # Drops the item from its state, and rewinds the cache to before the first
+    # sphere whose rules read it. Call collect_locations afterwards to
+    # explore back up to the fixpoint.
+    def uncollect(self, item):
+        names = {item.name, item.alias[0]} if item.alias else {item.name}
+        for index, (cache, collected, dependencies) in enumerate(self._sphere_log):
+            world_dependencies = dependencies[item.world.id]
+            if world_dependencies is None or not names.isdisjoint(world_dependencies):
+                break
+        else:
+            super().uncollect(item)
+            return
+
+        for _, collected, _ in self._sphere_log[index:]:
+            for collected_item in collected:
+                super().uncollect(collected_item)
+        self._cache = {k: copy.copy(v) for k, v in cache.items()}
+        self.cached_spheres = [self._cache]
+        del self._sphere_log[index:]
+        self._sphere_changed = True
+        self._start_sphere()
+        super().uncollect(item)
@@ -0,0 +1,119 @@
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import os
+import re
+from socketserver import ThreadingMixIn
+import time
+import traceback
+
+import Main
+from Main import main, resolve_settings, build_world_graphs, get_output_filename_base
+from Settings import Settings
+from SettingsList import setting_infos
+from Utils import default_output_path
+
+
+# Settings requests can choose: those in the settings string, cosmetics, and which files to output.
+# The others are paths, files and resources of the server, so they are always the server's.
+request_settings = {setting.name for setting in setting_infos if setting.shared or setting.cosmetic} | {
+    'seed', 'player_num', 'create_spoiler', 'create_cosmetics_log', 'create_patch_file',
+    'create_compressed_rom', 'create_uncompressed_rom', 'create_wad_file', 'patch_without_output',
+    'output_settings', 'bingosync_url',
+}
+
+
+# Runs a generation server on the given address, with settings.jobs worker processes.
+# Each request POSTs the settings as JSON to /generate, and gets back the seed,
+# the output files and the time it took, or the error if generation failed.
+def serve(settings, address):
+    logger = logging.getLogger('')
+    host, _, port = address.rpartition(':')
+    settings_json = settings.to_json_full()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(settings.jobs, 1),
+            initializer=init_worker, initargs=(settings_json, logger.getEffectiveLevel())) as executor:
+        server = GenerationServer((host or '127.0.0.1', int(port)), executor, settings_json)
+        logger.info('Generation server listening on %s:%d', *server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+# ThreadingHTTPServer is only in Python 3.7+
+class GenerationServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, executor, settings_json):
+        super().__init__(address, GenerationRequestHandler)
+        self.executor = executor
+        self.settings_json = settings_json
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path != '/generate':
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+            return
+        try:
+            request_json = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(request_json, dict):
+                raise ValueError('Expected a JSON object of settings')
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        settings_json = {name: value for name, value in self.server.settings_json.items() if name not in request_settings}
+        settings_json.update((name, value) for name, value in request_json.items() if name in request_settings)
+        # Output files are named after the seed, so requests don't overwrite each other's.
+        settings_json['output_file'] = ''
+        # Before Python 3.9 the executor's workers are daemons, which can't start
+        # worker processes of their own, so each request runs in its one worker.
+        settings_json.update(hint_jobs=1, parallel_attempts=1)
+        result = self.server.executor.submit(generate_request, settings_json).result()
+        self.send_json(500 if 'error' in result else 200, result)
+
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        logging.getLogger('').info('%s - %s', self.address_string(), format % args)
+
+
+# Warms up the worker: the logic of the server's settings is compiled,
+# and the base ROM is loaded if they output one, to be reused for every request.
+def init_worker(settings_json, loglevel):
+    logging.getLogger('').setLevel(max(loglevel, logging.WARNING))
+    Main.base_roms = {}
+    try:
+        settings = Settings(settings_json)
+        resolve_settings(settings)
+        build_world_graphs(settings)
+    except Exception as e:
+        logging.getLogger('').warning('Could not warm up generation worker: %s', e)
+
+
+def generate_request(settings_json):
+    start = time.perf_counter()
+    try:
+        settings = Settings(settings_json, strict=True)
+        main(settings)
+    except Exception:
+        return {'error': traceback.format_exc(), 'time': time.perf_counter() - start}
+    output_dir = default_output_path(settings.output_dir)
+    output_file = re.compile(r'%s(P\d+)?[._]' % re.escape(get_output_filename_base(settings)))
+    return {
+        'seed': settings.seed,
+        'files': sorted(os.path.join(output_dir, file) for file in os.listdir(output_dir) if output_file.match(file)),
+        'time': time.perf_counter() - start,
+    }
@@ -147,6 +147,8 @@ class Settings:
         for setting in filter(lambda s: s.shared and s.bitwidth > 0, setting_infos):
             cur_bits = bits[:setting.bitwidth]
             bits = bits[setting.bitwidth:]
+            # Strings from before a setting was added end before its bits, which read as 0.
+            cur_bits += [0] * (setting.bitwidth - len(cur_bits))
             value = None
             if setting.type == bool:
                 value = True if cur_bits[0] == 1 else False
@@ -375,6 +377,12 @@ class Settings:
     def to_json_cosmetics(self):
         return {setting.name: self.__dict__[setting.name] for setting in setting_infos if setting.cosmetic}
 
+    # All settings, shared or not, to create the same settings again, eg. in another process.
+    def to_json_full(self):
+        settings = {setting.name: self.__dict__[setting.name] for setting in setting_infos if not setting.shared}
+        settings.update(self.to_json())
+        return settings
+
 
 # gets the randomizer settings, whether to open the gui, and the logger level from command line arguments
 def get_settings_from_command_line_args():
@@ -390,6 +398,8 @@ def get_settings_from_command_line_args():
     parser.add_argument('--no_log', help='Suppresses the generation of a log file.', action='store_true')
     parser.add_argument('--output_settings', help='Always outputs a settings.json file even when spoiler is enabled.', action='store_true')
     parser.add_argument('--diff_rom', help='Generates a ZPF patch from the specified ROM file.')
+    parser.add_argument('--server', metavar='[HOST:]PORT', help='Run a generation server on the given address, generating up to --jobs seeds at a time.')
+    parser.add_argument('--jobs', type=int, help='Generate this many seeds at a time in separate processes when generating more than one.')
 
     args = parser.parse_args()
     settings_base = {}
@@ -420,6 +430,8 @@ def get_settings_from_command_line_args():
     settings = Settings(settings_base)
 
     settings.output_settings = args.output_settings
+    if args.jobs is not None:
+        settings.jobs = args.jobs
 
     if args.settings_string is not None:
         settings.update_with_settings_string(args.settings_string)
@@ -436,4 +448,4 @@ def get_settings_from_command_line_args():
             print(settings.get_settings_string())
         sys.exit(0)
 
-    return settings, args.gui, args.loglevel, args.no_log, args.diff_rom
+    return settings, args.gui, args.loglevel, args.no_log, args.diff_rom, args.server
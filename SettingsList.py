@@ -1899,6 +1899,16 @@ setting_infos = [
         }),
     Setting_Info('output_dir',        str, "Output Directory", "Directoryinput", False, {}),
     Setting_Info('output_file',       str, None, None, False, {}),
+    Setting_Info('logic_cache_dir',   str, None, None, False, {}),
+    Setting_Info('jobs',              int, None, None, False, {},
+        default        = 1,
+    ),
+    Setting_Info('parallel_attempts', int, None, None, False, {},
+        default        = 1,
+    ),
+    Setting_Info('hint_jobs',         int, None, None, False, {},
+        default        = 1,
+    ),
     Checkbutton(
         name           = 'show_seed_info',
         gui_text       = 'Show Seed Info on File Screen',
@@ -5655,6 +5665,18 @@ setting_infos = [
         default        = False,
         shared         = True,
     ),
+    # Settings strings pack the shared settings in this order, so new ones go last,
+    # which keeps the strings of earlier versions reading the same.
+    Combobox(
+        name           = 'fill_algorithm',
+        gui_text       = None,
+        choices        = {
+            'shuffle':     'Shuffle Locations',
+            'eligibility': 'Eligibility Bitsets',
+        },
+        default        = 'shuffle',
+        shared         = True,
+    ),
 ]
 
 
@@ -2,20 +2,38 @@
 # With python3.10, you can instead run pytest Unittest.py
 # See `python -m unittest -h` or `pytest -h` for more options.
 
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
+import concurrent.futures
 import json
 import logging
+import multiprocessing
 import os
 import random
 import re
+import tempfile
+import threading
 import unittest
+import unittest.mock
+import urllib.request
 
 from EntranceShuffle import EntranceShuffleError
+from Fill import FillEligibility
+import Hints
+from Hints import HintArea, HintAreaNotFound
 from Item import ItemInfo
 from ItemPool import remove_junk_items, remove_junk_ludicrous_items, ludicrous_items_base, ludicrous_items_extended, trade_items, ludicrous_exclusions
 from LocationList import location_is_viewable
-from Main import main, resolve_settings, build_world_graphs
+from Main import main, main_jobs, resolve_settings, build_world_graphs, place_items, generate, seed_attempt
+import Music
+from Messages import read_messages, repack_messages, ENG_TABLE_START, EXTENDED_TABLE_START, ENG_TEXT_SIZE_LIMIT, TEXT_START
+from N64Patch import create_patch_file, apply_patch_file
+from Patches import get_actor_index, scene_get_actors
+from Rom import Rom, RomBuffer, RomImage, RangeSet
+from RuleParser import compiled_logic
+from Search import Search, DecrementalSearch
+from Server import GenerationServer, init_worker
 from Settings import Settings, get_preset_files
+from Yaz0 import yaz0_encode, yaz0_decode
 
 test_dir = os.path.join(os.path.dirname(__file__), 'tests')
 output_dir = os.path.join(test_dir, 'Output')
@@ -511,6 +529,102 @@ class TestHints(unittest.TestCase):
         # 19 heart bridge / 20 heart gbk
         # TH
 
+    def test_hint_area_cache(self):
+        # Hint areas found before entrances are swapped must not be kept after.
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        world = build_world_graphs(settings)[0]
+        links_house = world.get_entrance('Kokiri Forest -> KF Links House')
+        potion_shop = world.get_entrance('Kakariko Village -> Kak Potion Shop Front')
+        self.assertEqual(HintArea.at(links_house.connected_region), HintArea.KOKIRI_FOREST)
+        self.assertEqual(HintArea.at(potion_shop.connected_region), HintArea.KAKARIKO_VILLAGE)
+        def hint_areas():
+            areas = {}
+            for region in world.regions:
+                try:
+                    areas[region] = HintArea.at(region)
+                except HintAreaNotFound:
+                    areas[region] = None
+            return areas
+        cached = hint_areas()
+
+        links_house_region = links_house.disconnect()
+        links_house.connect(potion_shop.disconnect())
+        potion_shop.connect(links_house_region)
+        self.assertEqual(HintArea.at(links_house_region), HintArea.KAKARIKO_VILLAGE)
+        swapped = hint_areas()
+        self.assertNotEqual(cached, swapped)
+        world.hint_areas.clear()
+        self.assertEqual(swapped, hint_areas())
+
+    def test_parallel_hints(self):
+        # Hints must be the same however many processes build them, and when they are built
+        # here because processes can't be forked.
+        spoilers = []
+        for hint_jobs, fork in ((2, True), (3, True), (2, False)):
+            settings = load_settings('multiworld.sav', seed='TESTTESTTEST')
+            settings.hint_jobs = hint_jobs
+            settings.output_file += '_%d_%s' % (hint_jobs, 'fork' if fork else 'here')
+            start_methods = multiprocessing.get_all_start_methods() if fork else ['spawn']
+            with unittest.mock.patch.object(multiprocessing, 'get_all_start_methods', return_value=start_methods):
+                main(settings)
+            spoilers.append(load_spoiler('%s_Spoiler.json' % settings.output_file)['gossip_stones'])
+        self.assertEqual(spoilers[0], spoilers[1])
+        self.assertEqual(spoilers[0], spoilers[2])
+
+
+    def test_hint_searches(self):
+        # Cached hint searches must give the same answers as new ones, also after a hint adds rules,
+        # after its rules are undone, and when searches are dropped to keep few enough.
+        settings = load_settings('odd-stones.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        place_items(settings, worlds)
+        world = worlds[0]
+        stones = [location for location in world.get_locations() if location.type == 'HintStone']
+        hinted = [location for location in world.get_filled_locations() if location.item.advancement and not location.locked]
+
+        def reachable_stones(location):
+            old_item = location.item
+            location.item = None
+            search = Search.max_explore([world.state for world in worlds])
+            location.item = old_item
+            return [stone for stone in stones if search.spot_access(stone) and search.state_list[0].guarantee_hint()]
+
+        def check(locations):
+            answers = []
+            for location in locations:
+                reachable = reachable_stones(location)
+                answers.append(reachable)
+                self.assertEqual([stone for stone in stones if Hints.can_reach_hint(worlds, stone, location)], reachable, location)
+            return answers
+
+        # A hint on the other locations from a stone that needs the first one's item
+        # makes them need it too.
+        first = next(location for location in hinted if len(reachable_stones(location)) < len(stones))
+        locations = [first] + [location for location in hinted if location is not first][:7]
+        blocked_stone = next(stone for stone in stones if stone not in reachable_stones(first))
+        max_hint_searches = Hints.max_hint_searches
+        Hints.hint_searches = OrderedDict()
+        Hints.max_hint_searches = 4
+        try:
+            before = check(locations[:3])
+            self.assertEqual(before, check(locations[:3]))
+            Hints.hint_events = []
+            Hints.add_hint_events(world, [blocked_stone.name], locations[1:])
+            events = Hints.hint_events
+            Hints.hint_events = None
+            self.assertNotEqual(before, check(locations[:3]))
+            Hints.undo_hint_events(events)
+            self.assertEqual(before, check(locations[:3]))
+            check(locations)
+            self.assertEqual(len(Hints.hint_searches), 4)
+        finally:
+            Hints.hint_events = None
+            Hints.hint_searches = None
+            Hints.max_hint_searches = max_hint_searches
+
+
 class TestEntranceRandomizer(unittest.TestCase):
     def test_spawn_point_invalid_areas(self):
         # With special interior, overworld, and warp song ER off, random spawns
@@ -535,6 +649,484 @@ class TestEntranceRandomizer(unittest.TestCase):
                 build_world_graphs(settings)
 
 
+class TestSearch(unittest.TestCase):
+    def test_decremental_search(self):
+        # Removing items one at a time must reach the same fixpoint as rebuilding the search.
+        settings = load_settings('multiworld.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        itempool = [item for world in worlds for item in world.itempool if item.advancement]
+        random.shuffle(itempool)
+        base_search = Search([world.state for world in worlds])
+        decremental_search = DecrementalSearch.from_search(base_search)
+        decremental_search.collect_all(itempool)
+        while itempool:
+            item = itempool.pop()
+            decremental_search.uncollect(item)
+            decremental_search.collect_locations()
+            max_search = Search.max_explore([world.state for world in worlds], itempool)
+            for age in ('child', 'adult'):
+                self.assertEqual(set(max_search.reachable_regions(age)), set(decremental_search.reachable_regions(age)))
+            for state, decremental_state in zip(max_search.state_list, decremental_search.state_list):
+                self.assertEqual(+state.prog_items, +decremental_state.prog_items)
+
+    def test_dependency_index(self):
+        # Rules must not read items outside the dependencies recorded on their spots.
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        world = build_world_graphs(settings)[0]
+        itempool = [item for item in world.itempool if item.advancement]
+        itempool += [location.item for location in world.get_locations() if location.item and location.item.advancement]
+        full_state = world.state.copy()
+        for item in itempool:
+            full_state.collect(item)
+        for spot in world.get_entrances() + world.get_locations():
+            with self.subTest(spot=spot.name):
+                if spot.dependencies is None or spot.reads_search:
+                    continue
+                dependent_state = world.state.copy()
+                for item in itempool:
+                    if item.name in spot.dependencies or (item.alias and item.alias[0] in spot.dependencies):
+                        dependent_state.collect(item)
+                for age in ('child', 'adult'):
+                    self.assertEqual(spot.access_rule(full_state, spot=spot, age=age),
+                                     spot.access_rule(dependent_state, spot=spot, age=age))
+
+
+class TestFill(unittest.TestCase):
+    def test_eligibility_candidates(self):
+        # Candidates must be the locations Location.can_fill allows, whether checked yet or not.
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        world = build_world_graphs(settings)[0]
+        locations = list(world.get_unfilled_locations())
+        eligibility = FillEligibility(locations)
+        for item in world.itempool:
+            expected = {location for location in locations if location.can_fill(world.state, item, False)}
+            self.assertEqual(set(eligibility.candidates(item)), expected)
+            self.assertEqual(eligibility.count(item), len(expected))
+        eligibility.remove(locations[0])
+        self.assertNotIn(locations[0], set(eligibility.candidates(world.itempool[0])))
+
+    def test_eligibility_fill(self):
+        # The eligibility fill algorithm must give the same seed every time.
+        for filename in ('disables.sav', 'plentiful.sav'):
+            with self.subTest(filename=filename):
+                spoilers = []
+                for _ in range(2):
+                    settings = load_settings(filename, seed='TESTTESTTEST')
+                    settings.fill_algorithm = 'eligibility'
+                    settings.output_file += '_eligibility'
+                    main(settings)
+                    spoiler = load_spoiler('%s_Spoiler.json' % settings.output_file)
+                    spoilers.append(spoiler)
+                self.assertEqual(spoilers[0], spoilers[1])
+
+
+class TestSettings(unittest.TestCase):
+    def test_settings_string(self):
+        # Strings made before fill_algorithm was added read the same settings,
+        # with fill_algorithm at its default, and still do once written again.
+        for filename, settings_string in [
+                ('plentiful.sav', 'BSAKMFQNALH2EAEAAACCSDEAAAAAAECAKLTDDSJFQNACAAUAAAA2UEAAAAPDAJHKCAAB'),
+                ('multiworld.sav', 'FSAKMFQNALH2EAWGAACASDEAAAAAAECABLTDDSJFQNACAAUSAB9CGVAEFEASASUXWFRKNGV46G33RCWBXJBAMCAAAWPAA7ELAAEA')]:
+            with self.subTest(filename):
+                settings = Settings({})
+                settings.update_with_settings_string(settings_string)
+                self.assertEqual(settings.settings_string, load_settings(filename).get_settings_string())
+                self.assertEqual(settings.fill_algorithm, 'shuffle')
+                # Its bits are the only ones added, at the end.
+                self.assertIn(settings.settings_string, (settings_string, settings_string + 'A'))
+                written = Settings({})
+                written.update_with_settings_string(settings.settings_string)
+                self.assertEqual(written.settings_string, settings.settings_string)
+
+
+class TestLogicCache(unittest.TestCase):
+    def test_cached_rules(self):
+        # Worlds loaded from the logic cache must get the same rules as freshly parsed ones.
+        def load_rules(cache_dir):
+            # Start from an empty process-wide cache, as a new process would.
+            compiled_logic.clear()
+            settings = load_settings('multiworld.sav', seed='TESTTESTTEST')
+            settings.logic_cache_dir = cache_dir
+            resolve_settings(settings)
+            worlds = build_world_graphs(settings)
+            return [{spot.name: (getattr(spot.access_rule, 'rule_str', None), spot.dependencies)
+                     for spot in world.get_entrances() + world.get_locations()}
+                    for world in worlds]
+
+        expected = load_rules('')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.assertEqual(expected, load_rules(cache_dir))
+            self.assertTrue(os.listdir(cache_dir))
+            self.assertEqual(expected, load_rules(cache_dir))
+
+        # A cache that can't be replaced leaves no temporary file behind.
+        with tempfile.TemporaryDirectory() as cache_dir:
+            load_rules(cache_dir)
+            cache_files = sorted(os.listdir(cache_dir))
+            for name in cache_files:
+                os.remove(os.path.join(cache_dir, name))
+                os.makedirs(os.path.join(cache_dir, name, 'keep'))
+            self.assertEqual(expected, load_rules(cache_dir))
+            self.assertEqual(cache_files, sorted(os.listdir(cache_dir)))
+
+    def test_shared_rules(self):
+        # Worlds with the same settings share the compiled rule functions.
+        compiled_logic.clear()
+        settings = load_settings('multiworld.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        rules = [{spot.name: spot.access_rule for spot in world.get_entrances() + world.get_locations()
+                  if hasattr(spot.access_rule, 'rule_str')}
+                 for world in worlds]
+        self.assertTrue(rules[0])
+        for other_rules in rules[1:]:
+            self.assertEqual(rules[0].keys(), other_rules.keys())
+            for name, rule in rules[0].items():
+                self.assertIs(rule, other_rules[name], name)
+
+
+class TestMainJobs(unittest.TestCase):
+    def test_jobs_match_serial(self):
+        # Seeds generated in worker processes must match the same seeds generated in this process.
+        settings = load_settings('odd-stones.sav', seed='TESTTESTTEST')
+        settings.count = 2
+        settings.jobs = 2
+        main_jobs(settings)
+        for i in range(settings.count):
+            job_spoiler = load_spoiler('%s-%d_Spoiler.json' % (settings.output_file, i))
+            serial_settings = load_settings('odd-stones.sav', seed='TESTTESTTEST')
+            serial_settings.update_seed('%s-%d' % (settings.seed, i))
+            main(serial_settings)
+            spoiler = load_spoiler('%s_Spoiler.json' % serial_settings.output_file)
+            self.assertEqual(spoiler, job_spoiler)
+
+    def test_parallel_attempts(self):
+        # The attempt picked must not depend on how many attempts run at the same time.
+        # The first three attempts of this seed fail, so the fourth is picked, and the spoiler
+        # generated again in this process must be the one a worker generated from the settings.
+        def placements(spoiler):
+            return spoiler.file_hash, {(location.world.id, location.name): location.item and location.item.name
+                                       for world in spoiler.worlds for location in world.get_locations()}
+        spoilers = []
+        for parallel_attempts in (2, 3):
+            settings = load_settings('entrance-warps.sav', seed='FAIL6')
+            settings.parallel_attempts = parallel_attempts
+            returned = placements(main(settings))
+            spoiler = load_spoiler('%s_Spoiler.json' % settings.output_file)
+            spoilers.append(spoiler)
+        self.assertEqual(spoilers[0], spoilers[1])
+        settings = load_settings('entrance-warps.sav', seed='FAIL6')
+        resolve_settings(settings, load_rom=False)
+        seed_attempt(settings, 4)
+        self.assertEqual(returned, placements(generate(settings)))
+
+
+class TestServer(unittest.TestCase):
+    def test_generate_request(self):
+        settings = load_settings('odd-stones.sav', seed='TESTTESTTEST')
+        settings.output_dir = os.path.join(test_dir, 'Output')
+        # Requests run in their one worker, whatever processes the server's settings would use.
+        settings.hint_jobs = settings.parallel_attempts = 4
+        settings_json = settings.to_json_full()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(settings_json, logging.WARNING)) as executor:
+            server = GenerationServer(('127.0.0.1', 0), executor, settings_json)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                with open(os.path.join(test_dir, 'odd-stones.sav')) as f:
+                    request_json = json.load(f)
+                # Paths are always the server's.
+                request_json.update(create_spoiler=True, seed='SERVERTEST', output_dir=os.path.join(test_dir, 'Elsewhere'))
+                request = urllib.request.Request('http://127.0.0.1:%d/generate' % server.server_address[1], data=json.dumps(request_json).encode('utf-8'))
+                with urllib.request.urlopen(request) as response:
+                    result = json.load(response)
+            finally:
+                server.shutdown()
+                server.server_close()
+        self.assertEqual(result['seed'], 'SERVERTEST')
+        spoiler_files = [file for file in result['files'] if file.endswith('_Spoiler.json')]
+        self.assertEqual(len(spoiler_files), 1)
+        self.assertEqual(os.path.dirname(spoiler_files[0]), settings.output_dir)
+        self.assertEqual(load_spoiler(spoiler_files[0])[':seed'], 'SERVERTEST')
+
+
+class TestRom(unittest.TestCase):
+    def test_restore(self):
+        # Restoring only copies back the pages written to, however they were written.
+        rom = Rom()
+        rom.original = Rom()
+        rom.original.buffer = bytearray(range(256)) * 256
+        rom.buffer = RomBuffer(rom.original.buffer)
+        rom.write_int32(0x10, 0xDEADBEEF)
+        rom.write_bytes(0x2FFE, [1, 2, 3, 4])
+        rom.buffer[0x8000:0x8002] = [5, 6]
+        rom.buffer[-1] = 7
+        self.assertEqual(rom.buffer.dirty_pages, {0, 2, 3, 8, 15})
+        rom.restore()
+        # Only the version number in the header is written again.
+        self.assertEqual(rom.buffer.dirty_pages, {0})
+        self.assertEqual(rom.buffer[0x40:], rom.original.buffer[0x40:])
+        self.assertEqual(rom.buffer[0x10:0x14], rom.original.buffer[0x10:0x14])
+
+        # Resizing the buffer restores all of it.
+        rom.buffer[0x100:0x100] = [0] * 0x10
+        self.assertIsNone(rom.buffer.dirty_pages)
+        rom.restore()
+        self.assertEqual(rom.buffer[0x40:], rom.original.buffer[0x40:])
+
+
+    def test_actor_index(self):
+        # Scenes changed in place, not only moved ones, must be walked again.
+        rom = Rom()
+        rom.original = Rom()
+        rom.original.buffer = bytearray(0xE00000)
+        rom.buffer = RomBuffer(rom.original.buffer)
+        scene_table = 0x00B71440
+        for scene in range(0x65):
+            scene_data, room_data = 0xC00000 + scene * 0x1000, 0xD00000 + scene * 0x1000
+            rom.write_int32(scene_table + scene * 0x14, scene_data)
+            # one room in the room list, and a room with two actors
+            rom.write_int32s(scene_data, [0x04010000, 0x02000100, 0x14000000, 0])
+            rom.write_int32s(scene_data + 0x100, [room_data, room_data + 0x200])
+            rom.write_int32s(room_data, [0x01020000, 0x03000100, 0x14000000, 0])
+            rom.write_int16(room_data + 0x100, scene)
+        rom.original.buffer[:] = rom.buffer
+        rom.restore()
+
+        def walk():
+            return [(scene, actor_id_address, actor) for scene in range(0x65)
+                    for actor_id_address, actor in scene_get_actors(rom, rom.read_int32(scene_table + scene * 0x14))]
+        self.assertEqual(list(get_actor_index(rom)), walk())
+        # add the room of scene 2 to the room list of scene 1
+        rom.write_int32s(0xC01000, [0x04020000, 0x02000100])
+        rom.write_int32s(0xC01108, [0xD02000, 0xD02200])
+        # and move scene 3
+        rom.write_int32(scene_table + 3 * 0x14, 0xC00000 + 0x70 * 0x1000)
+        rom.write_int32s(0xC70000, [0x14000000, 0])
+        actors = list(get_actor_index(rom))
+        self.assertEqual(actors, walk())
+        self.assertEqual(len([actor for actor in actors if actor[0] == 1]), 4)
+        self.assertEqual(len([actor for actor in actors if actor[0] == 3]), 0)
+
+    def test_rom_image(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            rom_file = os.path.join(tmpdir, 'test.z64')
+            with open(rom_file, 'wb') as f:
+                f.write(bytes(range(1, 256)) * 16)
+            rom = Rom()
+            rom.read_rom(rom_file)
+            image = RomImage(rom.buffer, 0x2000)
+            self.assertEqual(len(image), 0x2000)
+            self.assertEqual(image[0xFEE:0xFF2], bytes([0xFE, 0xFF, 0, 0]))
+            self.assertEqual(image[0x1FFF], 0)
+            self.assertRaises(IndexError, image.__getitem__, 0x2000)
+            buffer = RomBuffer(image)
+            self.assertEqual(buffer, image[:])
+            buffer[0x1800] = 1
+            buffer.restore()
+            self.assertEqual(buffer, image[:])
+            rom.buffer.close()
+
+
+    def test_update_header(self):
+        rom = Rom()
+        rom.buffer = RomBuffer(bytes(random.Random(0).getrandbits(8) for _ in range(0x102000)))
+        rom.update_header()
+        self.assertEqual(list(rom.buffer[0x10:0x18]), [0x42, 0x8A, 0x57, 0x9A, 0x9F, 0xAD, 0xEC, 0xD0])
+        rom.buffer[0x5000] ^= 1
+        rom.update_header()
+        self.assertEqual(list(rom.buffer[0x10:0x18]), [0x42, 0x8A, 0x57, 0x9A, 0x91, 0x9C, 0xD5, 0xC0])
+
+
+    def test_changed_ranges(self):
+        ranges = RangeSet()
+        for start, end in [(10, 20), (30, 40), (20, 25), (50, 60), (5, 8), (35, 55)]:
+            ranges.add(start, end)
+        self.assertEqual(list(ranges), [(5, 8), (10, 25), (30, 60)])
+        self.assertIn(59, ranges)
+        self.assertNotIn(60, ranges)
+        self.assertNotIn(8, ranges)
+
+        rom = Rom()
+        rom.original = Rom()
+        rom.original.buffer = bytearray(range(256)) * 256
+        rom.buffer = RomBuffer(rom.original.buffer)
+        rom.write_bytes(0x100, [1, 2, 3, 4])
+        rom.write_int32(0x104, 0x08090A0B)
+        rom.buffer[0x2000] = 0xFF
+        rom.rescan_changed_bytes()
+        self.assertEqual(list(rom.changed_ranges), [(0x100, 0x108), (0x2000, 0x2001)])
+
+
+    def test_patch_file(self):
+        def make_rom():
+            rom = Rom()
+            rom.original = Rom()
+            rom.original.buffer = original
+            rom.buffer = RomBuffer(original)
+            return rom
+        rng = random.Random(0)
+        original = bytearray(rng.getrandbits(8) for _ in range(0x60000))
+        original[0x7430:0x7440] = (0x7430).to_bytes(4, 'big') + (0x8000).to_bytes(4, 'big') + (0x7430).to_bytes(4, 'big') + bytes(4)
+        rom = make_rom()
+        rom.write_bytes(0x100, [0] * 0x10)
+        rom.write_bytes(0x10000, bytes(rng.getrandbits(8) for _ in range(0x20000)))
+        # Long runs of 0s still have to be split into blocks of at most 0xFFFF bytes.
+        rom.write_bytes(0x30000, bytes(0x18000) + b'\x01' + bytes(0x100))
+        rom.write_int32(0x5FFFC, 0x12345678)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            patch_file = os.path.join(tmpdir, 'test.zpf')
+            create_patch_file(rom, patch_file, xor_range=(0x40000, 0x50000))
+            patched = make_rom()
+            apply_patch_file(patched, patch_file)
+        self.assertEqual(patched.buffer, rom.buffer)
+
+
+    def test_dma_table(self):
+        rom = Rom()
+        rom.buffer = RomBuffer(0x10000)
+        rom.write_int32s(0x7430, [0, 0x1060, 0, 0, 0x1060, 0x7430, 0x1060, 0, 0x7430, 0x7490, 0x7430, 0,
+                                  0x8000, 0x8100, 0x8000, 0])
+        self.assertEqual(rom.get_dma_table_range(), (0x7430, 0x7490))
+        self.assertEqual(rom.get_dmadata_record_by_key(0x8000), (0x8000, 0x8100, 0x100))
+        self.assertEqual(rom.free_space(), 0x8100)
+        rom.update_dmadata_record(0x8000, 0x9000, 0x9008)
+        self.assertIsNone(rom.get_dmadata_record_by_key(0x8000))
+        self.assertEqual(rom.free_space(), 0x9010)
+        rom.update_dmadata_record(None, 0xA000, 0xA100)
+        self.assertEqual(rom.changed_dma, {3: (0x8000, 0x9000, 8), 4: (-1, 0xA000, 0x100)})
+        # Writing to the table directly is seen too.
+        rom.write_int32(0x7464, 0x9100)
+        self.assertEqual(rom.get_dmadata_record_by_key(0x9000), (0x9000, 0x9100, 0x100))
+        rom.write_int32(0x7470, 0x9080)
+        self.assertRaises(Exception, rom.verify_dmadata)
+        self.assertRaises(Exception, rom.update_dmadata_record, None, 0xB000, 0xB100)
+
+
+    def test_big_stream(self):
+        rom = Rom()
+        rom.original = Rom()
+        rom.original.buffer = RomImage(bytes(range(1, 9)), 0x10)
+        rom.buffer = RomBuffer(rom.original.buffer)
+        rom.write_int32s(0, [-1, 0x12345678])
+        rom.write_int16s(None, [0x1ABCD, 1])
+        self.assertEqual(rom.buffer.hex(), 'ffffffff12345678abcd000100000000')
+        self.assertEqual((rom.read_int32(4), rom.read_int16(None), rom.read_int24(0xA)), (0x12345678, 0xABCD, 0x100))
+        self.assertEqual(list(rom.changed_ranges), [(0, 0xC)])
+        self.assertEqual((rom.original.read_int32(4), rom.original.read_int16(0xE)), (0x05060708, 0))
+
+
+class TestMessages(unittest.TestCase):
+    def make_rom(self, texts):
+        rom = Rom()
+        rom.buffer = RomBuffer(ENG_TABLE_START + 8 * (len(texts) + 2))
+        rom.write_int32s(0x7430, [0, 0x1060, 0, 0, 0x1060, 0x7430, 0x1060, 0, 0x7430, 0x7490, 0x7430, 0,
+                                  TEXT_START, TEXT_START + ENG_TEXT_SIZE_LIMIT, TEXT_START, 0])
+        offset = 0
+        for index, text in enumerate(texts + [b'']):
+            message_id = 0xFFFD if index == len(texts) else index + 1
+            rom.write_bytes(ENG_TABLE_START + 8 * index, bytes([message_id >> 8, message_id & 0xFF, 0x23, 0, 7]) + offset.to_bytes(3, 'big'))
+            rom.write_bytes(TEXT_START + offset, text + b'\x02')
+            offset += (len(text) + 4) & -4
+        rom.write_bytes(ENG_TABLE_START + 8 * (len(texts) + 1), b'\xFF\xFF' + bytes(6))
+        return rom
+
+
+    def test_read_messages(self):
+        rom = self.make_rom([b'Hi', b'Yo'])
+        messages = read_messages(rom)
+        self.assertEqual([(m.id, m.text) for m in messages], [(1, 'Hi'), (2, 'Yo')])
+        # Each read gets its own messages.
+        messages[0].id |= 0x8000
+        self.assertEqual(read_messages(rom)[0].id, 1)
+        # Changed text is read again, up to the end of the last message.
+        rom.write_bytes(TEXT_START + 4, b'Ho')
+        self.assertEqual(read_messages(rom)[1].text, 'Ho')
+
+
+    def test_repack_messages(self):
+        # Messages are written sped up, with the endings of the messages they replace.
+        rom = self.make_rom([b'Hi\x1A', b'\x05\x41Red\x05\x40\x0E\x20', b'a\x14\x03b\x0C\x10c'])
+        messages = read_messages(rom)
+        repack_messages(rom, messages, [2, 1, 0])
+        self.assertEqual(rom.buffer[TEXT_START:TEXT_START + 24],
+                         b'\x08ab\x04\x08c\x02\x00' b'\x08\x05\x41Red\x05\x40\x0E\x20\x02\x00' b'\x08Hi\x02')
+        self.assertEqual(rom.buffer[EXTENDED_TABLE_START:EXTENDED_TABLE_START + 40],
+                         b'\x00\x01\x23\x00\x07\x00\x00\x00' b'\x00\x02\x23\x00\x07\x00\x00\x08' b'\x00\x03\x23\x00\x07\x00\x00\x14'
+                         b'\xFF\xFD\x00\x00\x07\x00\x00\x18' b'\xFF\xFF' + bytes(6))
+
+        self.assertRaises(TypeError, repack_messages, rom, read_messages(self.make_rom([bytes(0x1000)] * 0x40)))
+
+
+class TestMusic(unittest.TestCase):
+    def test_music_index(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, 'data', 'Music', 'Pack'))
+            try:
+                os.chdir(temp_dir)
+                for name, meta in [('a', 'Song A\n0x03\nbgm\n'), ('b', 'Fanfare B\n0x04\nfanfare\n')]:
+                    with open(os.path.join('data', 'Music', 'Pack', name + '.meta'), 'w') as f:
+                        f.write(meta)
+                    with open(os.path.join('data', 'Music', 'Pack', name + '.seq'), 'wb') as f:
+                        f.write(bytes(0x20))
+                Music.music_index = None
+                self.assertEqual(sorted(lines for _, _, lines in Music.read_music_index()),
+                                 [['Fanfare B', '0x04', 'fanfare'], ['Song A', '0x03', 'bgm']])
+
+                # Changed .meta files are read again, and the index is saved for the next process.
+                with open(os.path.join('data', 'Music', 'Pack', 'a.meta'), 'w') as f:
+                    f.write('Song A, edited\n0x03\nbgm\n')
+                os.remove(os.path.join('data', 'Music', 'Pack', 'b.meta'))
+                self.assertEqual([lines for _, _, lines in Music.read_music_index()], [['Song A, edited', '0x03', 'bgm']])
+                Music.music_index = None
+                self.assertEqual([lines for _, _, lines in Music.read_music_index()], [['Song A, edited', '0x03', 'bgm']])
+                self.assertTrue(os.path.isfile(Music.MUSIC_INDEX_FILE))
+
+                # An index that isn't valid is rebuilt.
+                for index in ('not json', '{"path": 1}', '[]'):
+                    with open(Music.MUSIC_INDEX_FILE, 'w') as f:
+                        f.write(index)
+                    Music.music_index = None
+                    self.assertEqual([lines for _, _, lines in Music.read_music_index()], [['Song A, edited', '0x03', 'bgm']])
+
+                # An index that can't be replaced leaves no temporary file behind.
+                os.remove(Music.MUSIC_INDEX_FILE)
+                os.makedirs(os.path.join(Music.MUSIC_INDEX_FILE, 'keep'))
+                Music.music_index = None
+                self.assertEqual([lines for _, _, lines in Music.read_music_index()], [['Song A, edited', '0x03', 'bgm']])
+                self.assertEqual(sorted(os.listdir(os.path.join('data', 'Music'))), ['.music_index.json', 'Pack'])
+
+                data = Music.read_sequence_file(os.path.join('data', 'Music', 'Pack', 'a.seq'))
+                data[1] = 0x20
+                self.assertEqual(Music.read_sequence_file(os.path.join('data', 'Music', 'Pack', 'a.seq')), bytes(0x20))
+            finally:
+                os.chdir(cwd)
+                Music.music_index = None
+                Music.sequence_data_cache.clear()
+
+
+class TestYaz0(unittest.TestCase):
+    def test_encode(self):
+        # Compressed the same as by the Compress binary.
+        data = b'Hello, Hello, Hello!' + bytes(0x30) + b'\x01\x02' * 6
+        self.assertEqual(yaz0_encode(data).hex(),
+                         '59617a30000000500000000000000000fe48656c6c6f2c20a006d8210000001d01028001000000000000000000000000')
+
+
+    def test_round_trip(self):
+        rng = random.Random(0)
+        with open(os.path.join(os.path.dirname(__file__), 'Main.py'), 'rb') as f:
+            text = f.read()
+        for data in [b'', b'ab', bytes(0x10000), bytes(rng.getrandbits(8) for _ in range(0x1000)), text,
+                     bytes(rng.choice(b'ab') for _ in range(0x4000)), (b'x' * 0x120 + b'y') * 0x40]:
+            compressed = yaz0_encode(data)
+            self.assertEqual(len(compressed) % 0x10, 0)
+            self.assertEqual(yaz0_decode(compressed, len(data)), data)
+
+
 class TestValidSpoilers(unittest.TestCase):
 
     # Normalizes spoiler dict for single world or multiple worlds
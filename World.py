@@ -1,5 +1,6 @@
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 import copy
+import itertools
 import logging
 import random
 import json
@@ -16,7 +17,6 @@ from Region import Region, TimeOfDay
 from RuleParser import Rule_AST_Transformer
 from SettingsList import get_setting_info, get_settings_from_section
 from State import State
-from Utils import read_logic_file
 
 class World(object):
 
@@ -29,6 +29,10 @@ class World(object):
         self._entrance_cache = {}
         self._region_cache = {}
         self._location_cache = {}
+        # The hint area HintArea.at found for each region, or None if there is none,
+        # and the regions whose hint area was searched for through each region's entrances.
+        self.hint_areas = {}
+        self.hint_area_dependents = defaultdict(set)
         self.required_locations = []
         self.shop_prices = {}
         self.scrub_prices = {}
@@ -442,7 +446,7 @@ class World(object):
 
 
     def load_regions_from_json(self, file_path):
-        region_json = read_logic_file(file_path)
+        region_json = self.parser.load_logic_file(file_path)
 
         for region in region_json:
             new_region = Region(region['region_name'])
@@ -496,6 +500,7 @@ class World(object):
                     else:
                         new_region.exits.append(new_exit)
             self.regions.append(new_region)
+        self.parser.save_logic_file()
 
 
     def create_internal_locations(self):
@@ -1004,6 +1009,12 @@ class World(object):
         return self._cached_locations
 
 
+    # Drops the hint areas found through the entrances of region, after they changed.
+    def clear_hint_areas(self, region):
+        for dependent in self.hint_area_dependents.pop(region, ()):
+            self.hint_areas.pop(dependent, None)
+
+
     def get_unfilled_locations(self):
         return filter(Location.has_no_item, self.get_locations())
 
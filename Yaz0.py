@@ -0,0 +1,282 @@
+import concurrent.futures
+import multiprocessing
+import os
+import struct
+
+from crc import calculate_crc
+from ntype import BigStream
+from Utils import local_path
+
+
+# Yaz0 compression of the ROM's files, done in-process. It is used when there is no
+# Compress or Decompress binary for this system. The encoder makes the same
+# choices as bin/Compress/src/yaz0.c, so compressed ROMs are the same as the Compress
+# binary's, and its ARCHIVE.bin of already compressed files can be shared with it.
+
+# number of leading 1 bits of each code byte, for runs of bytes copied as is
+leading_ones = [8 - (~code & 0xFF).bit_length() for code in range(0x100)]
+
+
+def yaz0_decode(data, size):
+    out = bytearray()
+    src = 0x10
+    while len(out) < size:
+        code = data[src]
+        src += 1
+        bits = 8
+        while bits and len(out) < size:
+            if code & 0x80:
+                # copy bytes as is
+                count = min(leading_ones[code], bits)
+                out += data[src:src + count]
+                src += count
+            else:
+                # copy bytes from earlier in the output
+                count = 1
+                byte1 = data[src]
+                copy_start = len(out) - (((byte1 & 0xF) << 8) | data[src + 1]) - 1
+                src += 2
+                copy_size = byte1 >> 4
+                if copy_size:
+                    copy_size += 2
+                else:
+                    copy_size = data[src] + 0x12
+                    src += 1
+                if copy_start + copy_size <= len(out):
+                    out += out[copy_start:copy_start + copy_size]
+                else:
+                    # the copy overlaps with itself, repeating the bytes
+                    pattern = out[copy_start:]
+                    out += (pattern * (copy_size // len(pattern) + 1))[:copy_size]
+            code = (code << count) & 0xFF
+            bits -= count
+    del out[size:]
+    return out
+
+
+def yaz0_encode(data):
+    data = bytes(data)
+    size = len(data)
+    out = bytearray(b'Yaz0' + struct.pack('>I', size) + bytes(8))
+
+    position = 0
+    code_position = len(out)
+    out.append(0)
+    code = 0
+    bitmask = 0x80
+    lookahead = None
+    while position < size:
+        # Use the match found by looking ahead if the last byte was copied for it.
+        # Otherwise, the best match is only used if the next byte doesn't have a much better one.
+        if lookahead:
+            match_size, match_start = lookahead
+            lookahead = None
+        else:
+            match_size, match_start = find_match(data, position)
+            if match_size >= 3:
+                next_size, next_start = find_match(data, position + 1)
+                if next_size >= match_size + 2:
+                    lookahead = (next_size, next_start)
+                    match_size = 1
+
+        if match_size < 3:
+            out.append(data[position])
+            code |= bitmask
+            position += 1
+        else:
+            distance = position - match_start - 1
+            if match_size > 0x11:
+                out += bytes((distance >> 8, distance & 0xFF, match_size - 0x12))
+            else:
+                out += bytes((((match_size - 2) << 4) | (distance >> 8), distance & 0xFF))
+            position += match_size
+
+        bitmask >>= 1
+        if not bitmask:
+            out[code_position] = code
+            code_position = len(out)
+            if position < size:
+                out.append(0)
+            code = 0
+            bitmask = 0x80
+
+    if code_position < len(out):
+        out[code_position] = code
+    # pad with 0s to a multiple of 16 bytes, like the Compress binary
+    out += bytes(((len(out) - 0x10 + 31) & -16) - len(out))
+    return out
+
+
+# Returns the size and start of the longest match for the bytes at position,
+# among the 0x1000 bytes before it. Of the longest matches, the first one is used.
+def find_match(data, position):
+    max_size = min(len(data) - position, 0x111)
+    if max_size < 3:
+        return 0, 0
+    window_start = max(position - 0x1000, 0)
+    match_start = data.find(data[position:position + 3], window_start, position + 2)
+    if match_start < 0:
+        return 0, 0
+    match_size = match_length(data, match_start, position, 3, max_size)
+    while match_size < max_size:
+        # find the first match at least one byte longer, if there is one
+        next_start = data.find(data[position:position + match_size + 1], match_start + 1, position + match_size)
+        if next_start < 0:
+            break
+        match_start = next_start
+        match_size = match_length(data, match_start, position, match_size + 1, max_size)
+    return match_size, match_start
+
+
+# Returns how many bytes from position match those from match_start, knowing the first min_size do.
+def match_length(data, match_start, position, min_size, max_size):
+    while min_size < max_size:
+        size = (min_size + max_size + 1) // 2
+        if data[match_start + min_size:match_start + size] == data[position + min_size:position + size]:
+            min_size = size
+        else:
+            max_size = size - 1
+    return min_size
+
+
+# Finds the DMA table by the entry of its first file, like the Compress and Decompress binaries.
+def find_dma_table(rom_data):
+    start = 0x1060
+    while True:
+        start = rom_data.find(b'\x00\x00\x00\x00\x00\x00\x10\x60', start, 0x4000000)
+        if start < 0:
+            raise RuntimeError('Could not find the DMA table in the ROM.')
+        if start % 4 == 0:
+            return start
+        start += 1
+
+
+def get_dma_entries(rom_data, dma_start):
+    dma_table_start, dma_table_end, _, _ = struct.unpack_from('>IIII', rom_data, dma_start + 0x20)
+    return [struct.unpack_from('>IIII', rom_data, dma_start + 0x10 * i) for i in range((dma_table_end - dma_table_start) // 0x10)]
+
+
+# Runs function on every file, in parallel if possible. Inside a --jobs or
+# server worker the other cores are already busy, so it runs serially there.
+def map_files(function, *files):
+    if len(files[0]) > 1 and (os.cpu_count() or 1) > 1 and multiprocessing.current_process().name == 'MainProcess':
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            return list(executor.map(function, *files))
+    return list(map(function, *files))
+
+
+def decompress_rom_data(rom_data):
+    if rom_data[0] == 0x37:
+        # byteswapped rom
+        swapped = bytearray(len(rom_data))
+        swapped[0::2] = rom_data[1::2]
+        swapped[1::2] = rom_data[0::2]
+        rom_data = swapped
+
+    dma_start = find_dma_table(rom_data)
+    dma_entries = get_dma_entries(rom_data, dma_start)
+    output = bytearray(0x4000000)
+    output[:dma_entries[2][1]] = rom_data[:dma_entries[2][1]]
+
+    # files that don't exist have no physical address
+    files = [(index, start, end, physical_start, physical_end) for index, (start, end, physical_start, physical_end) in enumerate(dma_entries)
+             if index >= 3 and physical_start < 0x4000000 and physical_end != 0xFFFFFFFF]
+    compressed = [file for file in files if file[4] != 0]
+    decompressed = map_files(yaz0_decode, [rom_data[file[3]:file[4]] for file in compressed], [file[2] - file[1] for file in compressed])
+    decompressed = dict(zip((file[0] for file in compressed), decompressed))
+
+    for index, start, end, physical_start, physical_end in files:
+        data = decompressed[index] if physical_end != 0 else rom_data[physical_start:physical_start + end - start]
+        output[start:start + len(data)] = data
+        struct.pack_into('>IIII', output, dma_start + 0x10 * index, start, end, start, 0)
+
+    output[0x10:0x18] = calculate_crc(BigStream(output))
+    return output
+
+
+# The files the Compress binary already compressed, by their decompressed data.
+def load_archive(archive_file):
+    archive = {}
+    try:
+        with open(archive_file, 'rb') as stream:
+            archive_data = stream.read()
+    except FileNotFoundError:
+        return None
+    position = 4
+    for _ in range(struct.unpack_from('<I', archive_data)[0]):
+        size = struct.unpack_from('<I', archive_data, position)[0]
+        decompressed = archive_data[position + 4:position + 4 + size]
+        position += 4 + size
+        size = struct.unpack_from('<I', archive_data, position)[0]
+        archive[decompressed] = archive_data[position + 4:position + 4 + size]
+        position += 4 + size
+    return archive
+
+
+def save_archive(archive_file, files):
+    with open(archive_file, 'wb') as stream:
+        stream.write(struct.pack('<I', len(files)))
+        for decompressed, compressed in files:
+            stream.write(struct.pack('<I', len(decompressed)))
+            stream.write(decompressed)
+            stream.write(struct.pack('<I', len(compressed)))
+            stream.write(compressed)
+
+
+# Compresses the files of a decompressed rom, except those dmaTable.dat lists, like the Compress binary.
+# ARCHIVE.bin keeps the compressed files, so the ones that weren't changed don't have to be compressed again.
+def compress_rom_data(rom_data, archive_file=None):
+    archive_file = archive_file or local_path('ARCHIVE.bin')
+    dma_start = find_dma_table(rom_data)
+    dma_entries = get_dma_entries(rom_data, dma_start)
+
+    # 1 to compress a file, 0 to copy it as is, and 2 if it shouldn't exist.
+    # The first 3 files are never compressed.
+    modes = [0, 0, 0] + [1] * (len(dma_entries) - 3)
+    with open(local_path('dmaTable.dat'), 'r') as stream:
+        for index in map(int, stream.read().split()):
+            if abs(index) >= len(dma_entries):
+                raise RuntimeError('Entry %d in dmaTable.dat is out of bounds' % index)
+            if index < 0:
+                modes[-index] = 2
+            else:
+                modes[index] = 0
+
+    archive = load_archive(archive_file)
+    files = [bytes(rom_data[start:end]) for start, end, _, _ in dma_entries]
+    to_compress = [index for index, mode in enumerate(modes) if mode == 1 and (archive is None or files[index] not in archive)]
+    compressed = dict(zip(to_compress, map_files(yaz0_encode, [files[index] for index in to_compress])))
+
+    output_data = []
+    for index, mode in enumerate(modes[3:], 3):
+        if mode == 1:
+            output_data.append(compressed[index] if index in compressed else archive[files[index]])
+        elif mode == 2:
+            output_data.append(b'')
+        else:
+            output_data.append(files[index])
+    physical_start = dma_start + len(dma_entries) * 0x10
+    output = bytearray(max(0x2000000, physical_start + sum(map(len, output_data))))
+    output[:physical_start] = rom_data[:physical_start]
+
+    archived = []
+    for index, data in enumerate(output_data, 3):
+        start, end, _, physical_end = dma_entries[index]
+        # files without data don't get an entry, but still take space if they are compressed
+        if start != end:
+            if modes[index] == 1:
+                physical_end = physical_start + len(data)
+                archived.append((files[index], data))
+                output[physical_start:physical_end] = data
+                struct.pack_into('>IIII', output, dma_start + 0x10 * index, start, end, physical_start, physical_end)
+            elif modes[index] == 2:
+                struct.pack_into('>IIII', output, dma_start + 0x10 * index, start, end, 0xFFFFFFFF, 0xFFFFFFFF)
+            else:
+                output[physical_start:physical_start + len(data)] = data
+                struct.pack_into('>IIII', output, dma_start + 0x10 * index, start, end, physical_start, physical_end)
+        physical_start += len(data)
+
+    output[0x10:0x18] = calculate_crc(BigStream(output))
+    if archive is None:
+        save_archive(archive_file, archived)
+    return output
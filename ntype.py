@@ -106,7 +106,12 @@ class BigStream(object):
     def read_int16(self, address=None):
         if address == None:
             address = self.last_address
-        return uint16.value(self.read_bytes(address, 2))
+        self.last_address = address + 2
+        try:
+            return uint16._struct.unpack_from(self.buffer, address)[0]
+        except TypeError:
+            # buffers without the buffer protocol, like RomImage, are read from a slice
+            return uint16._struct.unpack(self.buffer[address:address + 2])[0]
 
 
     def read_int24(self, address=None):
@@ -118,7 +123,11 @@ class BigStream(object):
     def read_int32(self, address=None):
         if address == None:
             address = self.last_address
-        return uint32.value(self.read_bytes(address, 4))
+        self.last_address = address + 4
+        try:
+            return uint32._struct.unpack_from(self.buffer, address)[0]
+        except TypeError:
+            return uint32._struct.unpack(self.buffer[address:address + 4])[0]
 
 
     def write_byte(self, address, value):
@@ -137,19 +146,19 @@ class BigStream(object):
     def write_int16(self, address, value):
         if address == None:
             address = self.last_address
-        self.write_bytes(address, uint16.bytes(value))
+        self.write_bytes(address, uint16._struct.pack(value & 0xFFFF))
 
 
     def write_int24(self, address, value):
         if address == None:
             address = self.last_address
-        self.write_bytes(address, uint24.bytes(value))
+        self.write_bytes(address, (value & 0xFFFFFF).to_bytes(3, 'big'))
 
 
     def write_int32(self, address, value):
         if address == None:
             address = self.last_address
-        self.write_bytes(address, uint32.bytes(value))
+        self.write_bytes(address, uint32._struct.pack(value & 0xFFFFFFFF))
 
 
     def write_f32(self, address, value:float):
@@ -165,25 +174,28 @@ class BigStream(object):
         self.buffer[startaddress:startaddress + len(values)] = values
 
 
+    # These pack all the values first, to write them at once.
     def write_int16s(self, startaddress, values):
         if startaddress == None:
             startaddress = self.last_address
-        for i, value in enumerate(values):
-            self.write_int16(startaddress + (i * 2), value)
+        values = [value & 0xFFFF for value in values]
+        if values:
+            self.write_bytes(startaddress, struct.pack('>%dH' % len(values), *values))
 
 
     def write_int24s(self, startaddress, values):
         if startaddress == None:
             startaddress = self.last_address
-        for i, value in enumerate(values):
-            self.write_int24(startaddress + (i * 3), value)
+        if values:
+            self.write_bytes(startaddress, b''.join((value & 0xFFFFFF).to_bytes(3, 'big') for value in values))
 
 
     def write_int32s(self, startaddress, values):
         if startaddress == None:
             startaddress = self.last_address
-        for i, value in enumerate(values):
-            self.write_int32(startaddress + (i * 4), value)
+        values = [value & 0xFFFFFFFF for value in values]
+        if values:
+            self.write_bytes(startaddress, struct.pack('>%dI' % len(values), *values))
 
 
     def append_byte(self, value):
@@ -195,15 +207,15 @@ class BigStream(object):
 
 
     def append_int16(self, value):
-        self.append_bytes(uint16.bytes(value))
+        self.append_bytes(uint16._struct.pack(value & 0xFFFF))
 
 
     def append_int24(self, value):
-        self.append_bytes(uint24.bytes(value))
+        self.append_bytes((value & 0xFFFFFF).to_bytes(3, 'big'))
 
 
     def append_int32(self, value):
-        self.append_bytes(uint32.bytes(value))
+        self.append_bytes(uint32._struct.pack(value & 0xFFFFFFFF))
 
 
     def append_f32(self, value:float):
@@ -211,20 +223,18 @@ class BigStream(object):
 
 
     def append_bytes(self, values):
-        for value in values:
-            self.append_byte(value)
+        self.buffer.extend(values)
 
 
     def append_int16s(self, values):
-        for value in values:
-            self.append_int16(value)
+        values = [value & 0xFFFF for value in values]
+        self.append_bytes(struct.pack('>%dH' % len(values), *values))
 
 
     def append_int24s(self, values):
-        for value in values:
-            self.append_int24(value)
+        self.append_bytes(b''.join((value & 0xFFFFFF).to_bytes(3, 'big') for value in values))
 
 
     def append_int32s(self, values):
-        for value in values:
-            self.append_int32(value)
+        values = [value & 0xFFFFFFFF for value in values]
+        self.append_bytes(struct.pack('>%dI' % len(values), *values))